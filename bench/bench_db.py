@@ -0,0 +1,86 @@
+"""Бенчмарк модуля db и генераторов викторин на синтетических словарях.
+
+    python -m bench.seed --sizes 1000 100000 1000000
+    python -m bench.bench_db --sizes 1000 100000 1000000 --output bench/results.jsonl
+
+С POSTGRES_REPLICA_DSNS чтения идут на реплики, в results.reads видно, сколько запросов куда ушло.
+Для проверки хватит одного сервера, указанного как реплика ещё раз.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import bench.fake_bot  # noqa: F401 (подставляет токен до импорта main)
+import db.db as db
+import main
+from bench.common import measure, write_results
+from bench.seed import language
+
+
+async def bench_language(size: int, iterations: int) -> dict:
+    lang = language(size)
+    results = {}
+    db.cache.invalidate((0, lang))
+    results['select_all_definitions_sql'] = await measure(lambda: db.select_all_definitions('a1', lang), iterations)
+    results['search_similar'] = await measure(lambda: db.search_similar('a1b2c3d4e5', lang), iterations)
+
+    start = time.perf_counter()
+    await db.select_n_random(1, lang)
+    results['cache_load_ms'] = (time.perf_counter() - start) * 1000
+    results['cache_bytes'] = db.cache.peek((0, lang)).size if db.cache.peek((0, lang)) else 0
+
+    results['select_n_random'] = await measure(lambda: db.select_n_random(4, lang, distinct=True), iterations)
+    results['select_last_n_terms'] = await measure(lambda: db.select_last_n_terms(5, lang), iterations)
+    results['select_all_definitions'] = await measure(lambda: db.select_all_definitions('a1', lang), iterations)
+
+    counter = itertools.count()
+
+    async def insert_and_delete():
+        word = f'bench{next(counter)}'
+        await db.insert(word, f'{word} definition', lang)
+        await db.delete(word, lang)
+
+    results['insert_delete'] = await measure(insert_and_delete, iterations)
+
+    rows = await db.select_last_n_terms(1000, lang)
+
+    async def prep_terms():
+        main.prep_terms(rows)
+
+    results['prep_terms_1000'] = await measure(prep_terms, iterations)
+    for quiz_type, create_question in main.quizzes.items():
+        async def generate():
+            create_question(await db.select_n_random(main.rows_per_question[quiz_type], lang, distinct=True), lang)
+
+        results[f'quiz {quiz_type}'] = await measure(generate, iterations)
+
+    async def quiz_session():
+        await main.create_quiz_session('Правильный перевод', 20, lang)
+
+    results['quiz_session_20'] = await measure(quiz_session, iterations)
+    return results
+
+
+async def run(sizes: list[int], iterations: int, output: str):
+    await db.init_pool()
+    try:
+        results = {}
+        for size in sizes:
+            print(f'Benchmarking {language(size)}')
+            results[language(size)] = await bench_language(size, iterations)
+        results['pool'] = db.pool.stats.as_dict()
+        results['cache'] = db.cache.stats.as_dict()
+        results['reads'] = {target: count for (target,), count in db.reads.values.items()}
+    finally:
+        await db.close_pool()
+    write_results(output, 'db', results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', default='bench/results.jsonl')
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.iterations, args.output))
@@ -0,0 +1,64 @@
+"""Прогон очереди отправки против поддельного Telegram с flood control.
+
+    python -m bench.bench_sender --chats 50 --messages 20 --chat-interval 0.5
+"""
+import argparse
+import asyncio
+import time
+
+from bench.fake_bot import FAKE_TOKEN, FakeTelegram
+from bench.common import summarize, write_results
+
+import sender
+
+
+async def run(chats: int, messages: int, chat_interval: float, rate: float, chat_rate: float, output: str):
+    telegram = FakeTelegram(chat_interval=chat_interval)
+    bot = sender.ScheduledBot(token=FAKE_TOKEN,
+                              sender=sender.Sender(rate=rate, chat_rate=chat_rate, chat_burst=1))
+    telegram.install(bot)
+    latencies = {'interactive': [], 'bulk': []}
+    max_depth = 0
+
+    async def send(chat_id: int, i: int, bulk: bool):
+        start = time.perf_counter()
+        if bulk:
+            with sender.bulk():
+                await bot.send_message(chat_id, f'bulk {i}')
+        else:
+            await bot.send_message(chat_id, f'reply {i}')
+        latencies['bulk' if bulk else 'interactive'].append(time.perf_counter() - start)
+
+    async def watch_depth():
+        nonlocal max_depth
+        while True:
+            max_depth = max(max_depth, bot.sender.depth)
+            await asyncio.sleep(0.01)
+
+    watcher = asyncio.create_task(watch_depth())
+    started_at = time.perf_counter()
+    await asyncio.gather(*[send(chat_id, i, bulk=i % 2 == 0)
+                           for i in range(messages) for chat_id in range(1, chats + 1)])
+    elapsed = time.perf_counter() - started_at
+    watcher.cancel()
+    await bot.sender.close()
+    await bot.close()
+    write_results(output, 'sender', {
+        'interactive': summarize(latencies['interactive'], elapsed),
+        'bulk': summarize(latencies['bulk'], elapsed),
+        'flood_errors': telegram.flood_errors,
+        'max_queue_depth': max_depth,
+        'elapsed_s': elapsed
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--chat-interval', type=float, default=0.5)
+    parser.add_argument('--rate', type=float, default=30)
+    parser.add_argument('--chat-rate', type=float, default=1)
+    parser.add_argument('--output', default='bench/results.jsonl')
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.messages, args.chat_interval, args.rate, args.chat_rate, args.output))
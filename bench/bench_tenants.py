@@ -0,0 +1,72 @@
+"""Бенчмарк словарей пользователей: как растут задержки с числом владельцев.
+
+    python -m bench.bench_tenants --tenants 10 100 1000 --words 1000 --output bench/results.jsonl
+
+Для каждого числа владельцев в язык bt добавляются недостающие словари по --words слов,
+после чего на случайных владельцах замеряются холодная загрузка словаря в кэш,
+поиск по префиксу и по триграммам в SQL и выборка случайных слов из кэша.
+С индексами, начинающимися с owner_id, задержки не должны зависеть от числа владельцев.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import db.db as db
+from bench.common import measure, summarize, write_results
+from bench.seed import seed_owners
+
+LANG = 'bt'
+FIRST_OWNER = 1
+
+
+async def bench_tenants(tenants: int, iterations: int) -> dict:
+    results = {}
+    owners = list(range(FIRST_OWNER, FIRST_OWNER + tenants))
+
+    latencies = []
+    for owner in random.sample(owners, min(iterations, tenants)):
+        db.cache.invalidate((owner, LANG))
+        start = time.perf_counter()
+        await db.select_n_random(1, LANG, owner=owner)
+        latencies.append(time.perf_counter() - start)
+    results['cache_load'] = summarize(latencies)
+    results['select_all_definitions_sql'] = await measure(
+        lambda: db._select_all_definitions('a1', LANG, random.choice(owners)), iterations)
+    results['search_similar'] = await measure(
+        lambda: db.search_similar('a1b2c3d4e5', LANG, owner=random.choice(owners)), iterations)
+
+    owner = random.choice(owners)
+    results['select_n_random'] = await measure(lambda: db.select_n_random(4, LANG, True, owner), iterations)
+    results['cached_dictionaries'] = len(db.cache)
+    results['cache_bytes'] = db.cache.size
+    return results
+
+
+async def run(tenants: list[int], words: int, iterations: int, output: str):
+    await db.init_pool()
+    try:
+        await db.init_db()
+        results = {}
+        seeded = 0
+        for n in sorted(tenants):
+            print(f'Seeding {n - seeded} more tenants with {words} words')
+            await seed_owners(LANG, words, list(range(FIRST_OWNER + seeded, FIRST_OWNER + n)))
+            seeded = n
+            print(f'Benchmarking {n} tenants')
+            results[f'{n}_tenants'] = await bench_tenants(n, iterations)
+        results['pool'] = db.pool.stats.as_dict()
+        results['cache'] = db.cache.stats.as_dict()
+    finally:
+        await db.close_pool()
+    write_results(output, 'tenants', {'words': words, **results})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--words', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--output', default='bench/results.jsonl')
+    args = parser.parse_args()
+    asyncio.run(run(args.tenants, args.words, args.iterations, args.output))
@@ -0,0 +1,55 @@
+import json
+import os
+import statistics
+import subprocess
+import time
+
+
+def summarize(latencies: list[float], elapsed: float = None) -> dict:
+    """p50/p99/среднее в миллисекундах и пропускная способность"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'count': 0}
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    return {
+        'count': len(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'ops_per_s': len(latencies) / elapsed if elapsed else 0.0
+    }
+
+
+async def measure(fn, iterations: int = 100, warmup: int = 5) -> dict:
+    for _ in range(warmup):
+        await fn()
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, time.perf_counter() - started_at)
+
+
+def _revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def write_results(path: str, suite: str, results: dict):
+    """Дописывает результаты строкой JSON, чтобы прогоны можно было сравнивать между собой"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    record = {
+        'suite': suite,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': _revision(),
+        'results': results
+    }
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(json.dumps(record, ensure_ascii=False, indent=2))
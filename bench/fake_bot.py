@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+
+from aiogram.utils.exceptions import RetryAfter
+
+FAKE_TOKEN = '123456789:AAHfakefakefakefakefakefakefakefake'
+
+if ':' not in os.getenv('DICT_API_TOKEN', ''):
+    os.environ['DICT_API_TOKEN'] = FAKE_TOKEN
+
+
+class FakeTelegram:
+    """Подменяет запросы бота: отвечает как Bot API, не выходя в сеть, и считает вызовы.
+
+    При chat_interval > 0 сообщения в один чат чаще раза в chat_interval секунд
+    получают RetryAfter, как при flood control у Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0, chat_interval: float = 0.0, retry_after: int = 1):
+        self.latency: float = latency
+        self.chat_interval: float = chat_interval
+        self.retry_after: int = retry_after
+        self.calls: dict[str, int] = {}
+        self.flood_errors: int = 0
+        self._sent_at: dict[int, float] = {}
+        self._message_ids = itertools.count(1)
+
+    def install(self, bot):
+        setattr(bot, 'send_request' if hasattr(bot, 'send_request') else 'request', self.request)
+
+    def _check_flood(self, chat_id: int):
+        now = time.monotonic()
+        if now - self._sent_at.get(chat_id, -self.chat_interval) < self.chat_interval:
+            self.flood_errors += 1
+            raise RetryAfter(self.retry_after)
+        self._sent_at[chat_id] = now
+
+    async def request(self, method: str, data: dict = None, files: dict = None, **kwargs):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = data or {}
+        if self.chat_interval and 'chat_id' in data:
+            self._check_flood(int(data['chat_id']))
+        if method in ('sendMessage', 'sendPoll', 'sendDocument', 'editMessageText'):
+            chat_id = int(data.get('chat_id', 0))
+            message = {
+                'message_id': int(data.get('message_id', 0)) or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': data.get('text', '')
+            }
+            if method == 'sendPoll':
+                options = data.get('options', [])
+                options = json.loads(options) if isinstance(options, str) else options
+                message['poll'] = {
+                    'id': str(message['message_id']),
+                    'question': data.get('question', ''),
+                    'options': [{'text': el, 'voter_count': 0} for el in options],
+                    'total_voter_count': 0,
+                    'is_closed': False,
+                    'is_anonymous': False,
+                    'type': data.get('type', 'quiz'),
+                    'allows_multiple_answers': False
+                }
+            return message
+        return True
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': text
+        }
+    }
+
+
+def poll_answer_update(update_id: int, user_id: int, option_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'poll_answer': {
+            'poll_id': str(update_id),
+            'user': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'option_ids': [option_id]
+        }
+    }
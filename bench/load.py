@@ -0,0 +1,100 @@
+"""Нагрузочный прогон обработчиков: N одновременных пользователей шлют апдейты в dp через поддельный Bot.
+
+    python -m bench.load --users 10 100 --lang b1000 --words 1000 --output bench/results.jsonl
+
+У каждого пользователя свой словарь, перед прогоном в него добавляется --words синтетических слов.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from bench.fake_bot import FakeTelegram, message_update, poll_answer_update
+from bench.common import summarize, write_results
+from bench.seed import seed_owners
+
+from aiogram import Bot, Dispatcher, types
+
+import main
+
+_update_ids = itertools.count(1)
+
+
+def scenario(lang: str, questions: int) -> list[tuple[str, str | int]]:
+    return [
+        ('message', '/start'),
+        ('message', '/random_5'),
+        ('message', lang),
+        ('message', '/select'),
+        ('message', lang),
+        ('message', 'a1'),
+        ('message', '/select_5'),
+        ('message', lang),
+        ('message', main.help_cmd['quizzes']),
+        ('message', lang),
+        ('message', 'Пропуск букв'),
+        ('message', str(questions)),
+        *[('message', 'a')] * questions,
+        ('message', main.help_cmd['quizzes']),
+        ('message', lang),
+        ('message', 'Правильный перевод'),
+        ('message', str(questions)),
+        *[('poll_answer', 0)] * questions
+    ]
+
+
+async def user(user_id: int, steps: list, latencies: list[float], errors: list[str]):
+    for kind, value in steps:
+        update_id = next(_update_ids)
+        if kind == 'message':
+            update = message_update(update_id, user_id, value)
+        else:
+            update = poll_answer_update(update_id, user_id, value)
+        start = time.perf_counter()
+        try:
+            await main.dp.updates_handler.notify(types.Update(**update))
+        except Exception as e:
+            errors.append(f'{kind} {value!r}: {e!r}')
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(users: list[int], lang: str, questions: int, words: int, telegram_latency: float,
+              chat_interval: float, output: str):
+    telegram = FakeTelegram(latency=telegram_latency, chat_interval=chat_interval)
+    telegram.install(main.bot)
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    await main.on_startup(main.dp)
+    results = {}
+    try:
+        for n in users:
+            latencies, errors = [], []
+            steps = scenario(lang, questions)
+            user_ids = [1000000 + n * 10000 + i for i in range(n)]
+            await seed_owners(lang, words, user_ids)
+            started_at = time.perf_counter()
+            await asyncio.gather(*[user(user_id, steps, latencies, errors) for user_id in user_ids])
+            results[f'{n}_users'] = {
+                **summarize(latencies, time.perf_counter() - started_at),
+                'errors': len(errors),
+                'first_errors': errors[:5]
+            }
+        results['telegram_calls'] = telegram.calls
+        results['flood_errors'] = telegram.flood_errors
+    finally:
+        await main.on_shutdown(main.dp)
+    write_results(output, 'load', results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--questions', type=int, default=5)
+    parser.add_argument('--words', type=int, default=1000)
+    parser.add_argument('--telegram-latency', type=float, default=0.0)
+    parser.add_argument('--chat-interval', type=float, default=0.0)
+    parser.add_argument('--output', default='bench/results.jsonl')
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.lang, args.questions, args.words, args.telegram_latency,
+                    args.chat_interval, args.output))
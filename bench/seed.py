@@ -0,0 +1,63 @@
+"""Заполнение локального Postgres синтетическими словарями.
+
+    python -m bench.seed --sizes 1000 100000 1000000
+
+Для каждого размера в реестр добавляется отдельный язык b<size> (b1000, b100000, ...) в общем словаре
+(владелец 0). Словари пользователей заполняются seed_owners теми же словами.
+Схема создаётся миграциями из db/migrations, если её ещё нет.
+"""
+import argparse
+import asyncio
+
+import db.db as db
+
+
+def language(size: int) -> str:
+    return f'b{size}'
+
+
+@db.execute_query
+def _seed(lang: str, size: int, owners: list[int] = (0,)) -> list[str | tuple[str, tuple]]:
+    """size слов в словаре каждого из owners. Определения общие для языка"""
+    owners = list(owners)
+    return [
+        ("""INSERT INTO words (owner_id, lang, word)
+            SELECT o, %s, left(md5(g::text), 12) FROM unnest(%s::bigint[]) o, generate_series(1, %s) g
+            ON CONFLICT DO NOTHING;""", (lang, owners, size)),
+        ("""INSERT INTO definitions (lang, definition)
+            SELECT %s, 'определение ' || g FROM generate_series(1, %s) g
+            ON CONFLICT DO NOTHING;""", (lang, size)),
+        ("""INSERT INTO link (word_id, definition_id)
+            SELECT words.id, definitions.id FROM definitions
+            JOIN words ON words.owner_id=ANY(%s) AND words.lang=definitions.lang
+                AND words.word=left(md5(split_part(definitions.definition, ' ', 2)), 12)
+            WHERE definitions.lang=%s
+            ON CONFLICT DO NOTHING;""", (owners, lang)),
+        'ANALYZE words, definitions, link;'
+    ]
+
+
+async def seed(sizes: list[int]):
+    await db.init_pool()
+    try:
+        await db.init_db()
+        for size in sizes:
+            lang = language(size)
+            print(f'Seeding {lang} with {size} words')
+            await db.add_language(lang)
+            await _seed(lang, size)
+    finally:
+        await db.close_pool()
+
+
+async def seed_owners(lang: str, size: int, owners: list[int]):
+    """Словари пользователей по size слов. Пул должен быть открыт"""
+    await db.add_language(lang)
+    for i in range(0, len(owners), 100):
+        await _seed(lang, size, owners[i:i + 100])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    asyncio.run(seed(parser.parse_args().sizes))
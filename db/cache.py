@@ -0,0 +1,212 @@
+import asyncio
+import bisect
+import random
+import sys
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from db.sampler import LinkSampler
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.hits: int = 0
+        self.misses: int = 0
+        self.loads: int = 0
+        self.evictions: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+
+_LINK_SIZE = 2 * 8 + 100
+
+
+def _size_of(*strings: str) -> int:
+    return sum(sys.getsizeof(el) for el in strings)
+
+
+class LanguageCache:
+    """Словарь одного языка: слово -> определения в порядке добавления слов"""
+
+    def __init__(self, lang: str):
+        self.lang: str = lang
+        self.terms: dict[str, list[str]] = {}
+        self.words: dict[int, str] = {}
+        self.definitions: dict[int, str] = {}
+        self.sampler: LinkSampler = LinkSampler()
+        self._word_ids: dict[str, int] = {}
+        self._definition_ids: dict[str, int] = {}
+        self._definition_refs: dict[int, int] = {}
+        self._index: list[tuple[str, str]] = []
+        self.size: int = 0
+
+    def add(self, word: str, definition: str, word_id: int, definition_id: int) -> bool:
+        definitions = self.terms.get(word)
+        if definitions is None:
+            definitions = self.terms[word] = []
+            self.words[word_id] = word
+            self._word_ids[word] = word_id
+            bisect.insort(self._index, (word.lower(), word))
+            self.size += _size_of(word)
+        elif definition in definitions:
+            return False
+        definitions.append(definition)
+        if definition_id not in self.definitions:
+            self.definitions[definition_id] = definition
+            self._definition_ids[definition] = definition_id
+            self.size += _size_of(definition)
+        self._definition_refs[definition_id] = self._definition_refs.get(definition_id, 0) + 1
+        self.sampler.add(word_id, definition_id)
+        self.size += _LINK_SIZE
+        return True
+
+    def remove(self, word: str) -> bool:
+        definitions = self.terms.pop(word, None)
+        if definitions is None:
+            return False
+        word_id = self._word_ids.pop(word)
+        del self.words[word_id]
+        for definition in definitions:
+            definition_id = self._definition_ids[definition]
+            self.sampler.remove(word_id, definition_id)
+            self._definition_refs[definition_id] -= 1
+            if not self._definition_refs[definition_id]:
+                del self._definition_refs[definition_id]
+                del self.definitions[definition_id]
+                del self._definition_ids[definition]
+                self.size -= _size_of(definition)
+        self.size -= _size_of(word) + _LINK_SIZE * len(definitions)
+        i = bisect.bisect_left(self._index, (word.lower(), word))
+        if i < len(self._index) and self._index[i] == (word.lower(), word):
+            del self._index[i]
+        return True
+
+    def rows(self, word: str) -> list[tuple[str, str]]:
+        return [(word, definition) for definition in self.terms.get(word, [])]
+
+    def word_id(self, word: str) -> int | None:
+        return self._word_ids.get(word)
+
+    def term(self, word_id: int) -> tuple[str, str] | None:
+        """Слово и одно из его определений"""
+        word = self.words.get(word_id)
+        if word is None:
+            return None
+        return word, random.choice(self.terms[word])
+
+    def last_n(self, n: int) -> list[tuple[str, str]]:
+        result = []
+        for word in reversed(self.terms):
+            for definition in self.terms[word]:
+                if len(result) == n:
+                    return result
+                result.append((word, definition))
+        return result
+
+    def random_n(self, n: int, distinct: bool = False) -> list[tuple[str, str]]:
+        return [(self.words[word_id], self.definitions[definition_id])
+                for word_id, definition_id in self.sampler.sample(n, distinct)]
+
+    def prefix(self, prefix: str) -> list[tuple[str, str]]:
+        prefix = prefix.lower()
+        result = []
+        for i in range(bisect.bisect_left(self._index, (prefix,)), len(self._index)):
+            lowered, word = self._index[i]
+            if not lowered.startswith(prefix):
+                break
+            result.extend(self.rows(word))
+        return result
+
+
+class DictionaryCache:
+    """LRU-кэш словарей по ключу (владелец, язык) с ограничением по памяти"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.stats: CacheStats = CacheStats()
+        self._languages: OrderedDict[tuple[int, str], LanguageCache] = OrderedDict()
+        self._loading: dict[tuple[int, str], asyncio.Task] = {}
+        self._changed: dict[tuple[int, str], bool] = {}
+        self.size: int = 0
+
+    def __len__(self) -> int:
+        return len(self._languages)
+
+    def peek(self, key: tuple[int, str]) -> LanguageCache | None:
+        return self._languages.get(key)
+
+    async def get(self, key: tuple[int, str],
+                  load: Callable[[int, str], Awaitable[list[tuple[str, str, int, int]]]]) -> LanguageCache:
+        language = self._languages.get(key)
+        if language is not None:
+            self.stats.hits += 1
+            self._languages.move_to_end(key)
+            return language
+        self.stats.misses += 1
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.create_task(self._load(key, load))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple[int, str],
+                    load: Callable[[int, str], Awaitable[list[tuple[str, str, int, int]]]]) -> LanguageCache:
+        """Одна загрузка на ключ. Если словарь изменился во время загрузки, результат не кэшируется"""
+        self._changed[key] = False
+        try:
+            language = LanguageCache(key[1])
+            for word, definition, word_id, definition_id in await load(*key):
+                language.add(word, definition, word_id, definition_id)
+            self.stats.loads += 1
+            if not self._changed[key]:
+                self._languages[key] = language
+                self.size += language.size
+                self._evict()
+            else:
+                logger.debug(f'Dictionary {key} changed while loading, not caching it')
+            return language
+        finally:
+            del self._changed[key]
+            del self._loading[key]
+
+    def _change(self, key: tuple[int, str]):
+        if key in self._changed:
+            self._changed[key] = True
+
+    def invalidate(self, key: tuple[int, str]):
+        self._change(key)
+        language = self._languages.pop(key, None)
+        if language is not None:
+            self.size -= language.size
+
+    def added(self, key: tuple[int, str], word: str, definition: str, word_id: int, definition_id: int):
+        self._change(key)
+        language = self._languages.get(key)
+        if language is not None:
+            size = language.size
+            language.add(word, definition, word_id, definition_id)
+            self.size += language.size - size
+            self._evict()
+
+    def removed(self, key: tuple[int, str], word: str):
+        self._change(key)
+        language = self._languages.get(key)
+        if language is not None:
+            size = language.size
+            language.remove(word)
+            self.size += language.size - size
+
+    def _evict(self):
+        while len(self._languages) > 1 and self.size > self.max_bytes:
+            key, language = self._languages.popitem(last=False)
+            self.size -= language.size
+            self.stats.evictions += 1
+            logger.debug(f'Evicted dictionary {key} from cache')
@@ -1,106 +1,679 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
 import os
+import time
+from collections import OrderedDict
+
 import psycopg2
+import psycopg2.extensions
 from loguru import logger
 from dotenv import load_dotenv
 
+import metrics
+from db.cache import DictionaryCache, LanguageCache
+from db.pool import Pool, PoolTimeout
+from db.replicas import Replicas
+
 load_dotenv()
 
+pool: Pool | None = None
+replicas: Replicas | None = None
+languages: list[str] = []
+cache = DictionaryCache(max_bytes=int(float(os.getenv('DICT_CACHE_MAX_MB', 64)) * 1024 * 1024))
+slow_query_threshold = float(os.getenv('DB_SLOW_QUERY_MS', 200)) / 1000
+_use_primary: contextvars.ContextVar[bool] = contextvars.ContextVar('use_primary', default=False)
+_written: OrderedDict[int, float] = OrderedDict()
+
+metrics.registry.gauge('dict_db_pool', 'Connection pool statistics',
+                       lambda: {(k,): v for k, v in pool.stats.as_dict().items()} if pool else {}, ('stat',))
+metrics.registry.gauge('dict_cache', 'Dictionary cache statistics',
+                       lambda: {(k,): v for k, v in {**cache.stats.as_dict(), 'bytes': cache.size,
+                                                     'dictionaries': len(cache)}.items()},
+                       ('stat',))
+metrics.registry.gauge('dict_db_replicas', 'Read replica health and replication lag in seconds',
+                       lambda: {(str(i), stat): value
+                                for i, (healthy, lag) in enumerate(zip(replicas.healthy, replicas.lag))
+                                for stat, value in (('healthy', int(healthy)), ('lag', lag)) if value is not None}
+                       if replicas else {}, ('replica', 'stat'))
+reads = metrics.registry.counter('dict_db_reads_total', 'Read queries by server', ('target',))
+
+
+async def init_pool() -> Pool:
+    """Пул основного сервера и, если заданы POSTGRES_REPLICA_DSNS (через запятую), пулы реплик для чтения"""
+    global pool, replicas
+    if pool is None:
+        pool_kwargs = dict(min_size=int(os.getenv('POSTGRES_POOL_MIN_SIZE', 1)),
+                           max_size=int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10)),
+                           timeout=float(os.getenv('POSTGRES_POOL_TIMEOUT', 5)),
+                           health_check_interval=float(os.getenv('POSTGRES_POOL_HEALTH_CHECK_INTERVAL', 30)),
+                           sslmode='allow',
+                           connection_factory=Connection)
+        pool = Pool(dbname=os.getenv('POSTGRES_DB'),
+                    user=os.getenv('POSTGRES_USER'),
+                    password=os.getenv('POSTGRES_PASSWORD'),
+                    host=os.getenv('POSTGRES_HOST'),
+                    port=os.getenv('POSTGRES_PORT'),
+                    **pool_kwargs)
+        await pool.open()
+        dsns = [el.strip() for el in os.getenv('POSTGRES_REPLICA_DSNS', '').split(',') if el.strip()]
+        if dsns:
+            replicas = Replicas(dsns,
+                                max_lag=float(os.getenv('POSTGRES_REPLICA_MAX_LAG', 5)),
+                                check_interval=float(os.getenv('POSTGRES_REPLICA_CHECK_INTERVAL', 5)),
+                                **pool_kwargs)
+            await replicas.open()
+    return pool
+
+
+async def close_pool():
+    global pool, replicas
+    if replicas is not None:
+        await replicas.close()
+        replicas = None
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@contextlib.contextmanager
+def primary(force: bool = True):
+    """Чтение с основного сервера внутри блока, в том числе в задачах, созданных в нём"""
+    token = _use_primary.set(_use_primary.get() or force)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def _wrote(owner: int):
+    """Запомнить запись в словарь owner: пока реплики могут её не видеть, его читаем с основного сервера"""
+    if replicas is None:
+        return
+    now = time.monotonic()
+    _written[owner] = now
+    _written.move_to_end(owner)
+    while next(iter(_written.values())) < now - replicas.max_lag - replicas.check_interval:
+        _written.popitem(last=False)
+
+
+def _recently_wrote(owner: int) -> bool:
+    written_at = _written.get(owner)
+    return (replicas is not None and written_at is not None
+            and time.monotonic() - written_at <= replicas.max_lag + replicas.check_interval)
+
+
+def _read_pool() -> Pool | None:
+    if replicas is None or _use_primary.get():
+        return None
+    return replicas.pool()
+
+
+class Connection(psycopg2.extensions.connection):
+    """Соединение, которое помнит подготовленные на сервере запросы"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
 
-def execute_query(func):
-    def wrapper(*args, **kwargs):
+
+class Statement:
+    """Запрос, который готовится на сервере (PREPARE) один раз на соединение и дальше выполняется через EXECUTE"""
+
+    def __init__(self, name: str, sql: str, types: tuple[str, ...] = ()):
+        self.name: str = f'dict_{name}'
+        self.prepare_sql: str = f'PREPARE {self.name}' + (f' ({", ".join(types)})' if types else '') + f' AS {sql}'
+        self.execute_sql: str = f'EXECUTE {self.name}' + (f' ({", ".join(["%s"] * len(types))})' if types else '')
+
+    def __repr__(self) -> str:
+        return f'Statement({self.name})'
+
+    def execute(self, cursor, params: tuple = ()):
+        prepared = cursor.connection.prepared
+        if self.name not in prepared:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+        cursor.execute(self.execute_sql, params)
+
+
+def _execute(connection, queries: list[str | tuple[str | Statement, tuple]], strict: bool = False):
+    """Выполнение запросов по очереди. Ошибки запросов логируются, при strict=True пробрасываются"""
+    with connection.cursor() as cursor:
+        for query in queries:
+            try:
+                if isinstance(query, tuple) and isinstance(query[0], Statement):
+                    query[0].execute(cursor, *query[1:])
+                elif isinstance(query, tuple):
+                    cursor.execute(*query)
+                else:
+                    cursor.execute(query)
+            except psycopg2.Error as e:
+                if strict:
+                    raise
+                logger.debug(
+                    f'Query: {query}. Error message - {e}')
+            connection.commit()
+        if cursor.description is None:
+            return True
+        return cursor.fetchall()
+
+
+async def _run(function: str, fn, *args, read: bool = False):
+    """fn(connection, *args) на основном сервере. При read=True на реплике, если есть здоровая"""
+    if pool is None:
+        raise RuntimeError('Connection pool is not initialized, call db.init_pool() on startup')
+    start = time.perf_counter()
+    replica = _read_pool() if read else None
+    if replica is not None:
+        try:
+            results = await replica.run(fn, *args)
+            reads.inc(target='replica')
+        except (psycopg2.Error, PoolTimeout) as e:
+            replicas.failed(replica, e)
+            results = await pool.run(fn, *args)
+            reads.inc(target='primary')
+    else:
+        results = await pool.run(fn, *args)
+        if read:
+            reads.inc(target='primary')
+    elapsed = time.perf_counter() - start
+    metrics.query_seconds.observe(elapsed, function=function)
+    metrics.query_rows.observe(len(results) if isinstance(results, list) else 0, function=function)
+    if elapsed > slow_query_threshold:
+        metrics.slow_queries.inc(function=function)
+        logger.warning(f'Slow query {function}: {elapsed * 1000:.0f} ms, args: {metrics.truncate(args[0])}')
+    logger.debug(f'{function}: {metrics.truncate(results)}')
+    return results
+
+
+def execute_query(func, read: bool = False, strict: bool = False):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
         queries = func(*args, **kwargs)
-        logger.info(queries)
-        if isinstance(queries, str):
+        logger.debug(queries)
+        if isinstance(queries, (str, tuple)):
             queries = [queries]
-        with psycopg2.connect(dbname=os.getenv('POSTGRES_DB'),
-                              user=os.getenv('POSTGRES_USER'),
-                              password=os.getenv('POSTGRES_PASSWORD'),
-                              host=os.getenv('POSTGRES_HOST'),
-                              port=os.getenv('POSTGRES_PORT'),
-                              sslmode='allow') as connection:
-            with connection.cursor() as cursor:
-                for query in queries:
-                    try:
-                        cursor.execute(query)
-                    except psycopg2.Error as e:
-                        logger.debug(
-                            f'Query: {query}. Error message - {e}')
-                    connection.commit()
-                if any([el in str(cursor.query) for el in ['INSERT INTO', 'DELETE FROM']]):
-                    results = True
-                else:
-                    results = cursor.fetchall()
-                logger.info(results)
-        return results
+        return await _run(func.__name__.lstrip('_'), _execute, queries, strict or read, read=read)
 
     return wrapper
 
 
+def strict_query(func):
+    """Как execute_query, но ошибка запроса пробрасывается вызывающему"""
+    return execute_query(func, strict=True)
+
+
+def read_query(func):
+    """Как execute_query, но только для чтения: запрос может уйти на реплику.
+
+    Ошибка запроса пробрасывается: реплика исключается, запрос повторяется на основном сервере,
+    а если не удался и там, ошибку получает вызывающий код, а не пустой результат.
+    """
+    return execute_query(func, read=True)
+
+
+MIGRATIONS_DIR = os.path.join('db', 'migrations')
+MIGRATIONS_LOCK_ID = 727001
+
+
+def _migrate(connection, path: str) -> list[str]:
+    """Применение ещё не применённых миграций NNNN_name.sql по порядку в одной транзакции"""
+    applied = []
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s);', (MIGRATIONS_LOCK_ID,))
+            cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now());""")
+            cursor.execute('SELECT version FROM schema_migrations;')
+            versions = {el[0] for el in cursor.fetchall()}
+            for name in sorted(el for el in os.listdir(path) if el.endswith('.sql')):
+                version = int(name.split('_', 1)[0])
+                if version in versions:
+                    continue
+                with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+                    cursor.execute(f.read())
+                cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s);', (version, name))
+                applied.append(name)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    return applied
+
+
+async def init_db(path: str = MIGRATIONS_DIR) -> list[str]:
+    """Создание и обновление схемы. Повторный запуск ничего не делает"""
+    applied = await _run('init_db', _migrate, path)
+    if applied:
+        logger.info(f'Applied migrations: {", ".join(applied)}')
+    return applied
+
+
 @execute_query
-def _init_db() -> str:
-    with open(os.path.join('db', "create_db.sql"), "r") as f:
-        sql = f.read()
-    return sql
+def _select_languages() -> str:
+    return 'SELECT code FROM languages ORDER BY code;'
 
 
-def select_all_query(lang: str = 'eng') -> str:
-    return f"""SELECT {lang}_words.word, {lang}_definitions.definition
-        FROM {lang}_link
-        JOIN {lang}_words ON {lang}_words.id={lang}_link.word_id
-        JOIN {lang}_definitions ON {lang}_definitions.id={lang}_link.definition_id"""
+async def load_languages() -> list[str]:
+    """Загрузка реестра языков. Список db.languages обновляется на месте"""
+    results = await _select_languages()
+    languages[:] = [el[0] for el in results] if isinstance(results, list) else []
+    logger.info(f'Languages: {", ".join(languages)}')
+    return languages
 
 
 @execute_query
-def select_all(lang: str = 'eng') -> str:
-    return select_all_query(lang) + f'ORDER BY {lang}_words.word'
+def add_language(code: str) -> tuple[str, tuple]:
+    return 'INSERT INTO languages (code) VALUES (%s) ON CONFLICT DO NOTHING;', (code,)
+
+
+SELECT_TERMS = """SELECT words.word, definitions.definition
+        FROM words
+        JOIN link ON link.word_id=words.id
+        JOIN definitions ON definitions.id=link.definition_id"""
+
+select_all_statement = Statement('select_all',
+                                 SELECT_TERMS + ' WHERE words.owner_id=$1 AND words.lang=$2 ORDER BY words.word',
+                                 ('bigint', 'varchar'))
+
+
+@read_query
+def select_all(lang: str = 'eng', owner: int = 0) -> tuple[Statement, tuple]:
+    return select_all_statement, (owner, lang)
+
+
+stream_all_statement = Statement('stream_all', """SELECT words.word, definitions.definition, definitions.id
+        FROM words
+        JOIN link ON link.word_id=words.id
+        JOIN definitions ON definitions.id=link.definition_id
+        WHERE words.owner_id=$1 AND words.lang=$2 AND words.word >= $3 AND (words.word, definitions.id) > ($3, $4)
+        ORDER BY words.word, definitions.id
+        LIMIT $5""", ('bigint', 'varchar', 'varchar', 'integer', 'integer'))
+
+
+@read_query
+def _select_all_after(owner: int, lang: str, word: str, definition_id: int,
+                      limit: int) -> tuple[Statement, tuple]:
+    return stream_all_statement, (owner, lang, word, definition_id, limit)
+
+
+async def stream_all(lang: str = 'eng', batch_size: int = 1000, owner: int = 0):
+    """Весь словарь владельца, отсортированный по слову, пачками.
+
+    Каждая пачка - отдельный короткий запрос, продолжающий с последней строки предыдущей,
+    поэтому между пачками не держатся ни соединение, ни транзакция.
+    """
+    word, definition_id = '', 0
+    while True:
+        with primary(_recently_wrote(owner)):
+            rows = await _select_all_after(owner, lang, word, definition_id, batch_size)
+        if not rows:
+            return
+        word, _, definition_id = rows[-1]
+        yield [row[:2] for row in rows]
+        if len(rows) < batch_size:
+            return
+
+
+select_dictionary_statement = Statement('select_dictionary', """SELECT
+            words.word, definitions.definition, words.id, definitions.id
+        FROM words
+        JOIN link ON link.word_id=words.id
+        JOIN definitions ON definitions.id=link.definition_id
+        WHERE words.owner_id=$1 AND words.lang=$2
+        ORDER BY words.id""", ('bigint', 'varchar'))
+
+
+@read_query
+def _select_dictionary(owner: int, lang: str = 'eng') -> tuple[Statement, tuple]:
+    return select_dictionary_statement, (owner, lang)
+
+
+async def _dictionary(lang: str = 'eng', owner: int = 0) -> LanguageCache:
+    with primary(_recently_wrote(owner)):
+        return await cache.get((owner, lang), _select_dictionary)
+
+
+@read_query
+def _select_recent_dictionaries(limit: int, words: int) -> tuple[str, tuple]:
+    return """SELECT owner_id, lang FROM (
+            SELECT id, owner_id, lang FROM words ORDER BY id DESC LIMIT %s) recent
+        GROUP BY owner_id, lang
+        ORDER BY max(id) DESC
+        LIMIT %s;""", (words, limit)
+
+
+async def preload(limit: int = 100, words: int = 10000) -> int:
+    """Загрузка в кэш словарей, в которые недавно добавляли слова, пока бот ещё не принимает апдейты"""
+    results = await _select_recent_dictionaries(limit, words)
+    keys = results if isinstance(results, list) else []
+    await asyncio.gather(*(_dictionary(lang, owner) for owner, lang in keys))
+    return len(keys)
+
+
+async def select_last_n_terms(n: int, lang: str = 'eng', owner: int = 0) -> list[tuple[str, str]]:
+    return (await _dictionary(lang, owner)).last_n(n)
+
+
+async def select_n_random(n: int, lang: str = 'eng', distinct: bool = False, owner: int = 0) -> list[tuple[str, str]]:
+    return (await _dictionary(lang, owner)).random_n(n, distinct)
+
+
+def _like_prefix(word: str) -> str:
+    return word.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+select_all_definitions_statement = Statement('select_all_definitions', SELECT_TERMS + """
+        WHERE words.owner_id=$1 AND words.lang=$2 AND lower(words.word) LIKE $3""", ('bigint', 'varchar', 'text'))
+
+
+@read_query
+def _select_all_definitions(word: str, lang: str = 'eng', owner: int = 0) -> tuple[Statement, tuple]:
+    return select_all_definitions_statement, (owner, lang, _like_prefix(word))
+
+
+async def select_all_definitions(word: str, lang: str = 'eng', owner: int = 0) -> list[tuple[str, str]]:
+    language = cache.peek((owner, lang))
+    if language is not None:
+        return language.prefix(word)
+    with primary(_recently_wrote(owner)):
+        return await _select_all_definitions(word, lang, owner)
+
+
+search_similar_statement = Statement('search_similar', """SELECT word FROM words
+        WHERE owner_id=$1 AND lang=$2 AND lower(word) % $3
+        ORDER BY similarity(lower(word), $3) DESC, word
+        LIMIT $4""", ('bigint', 'varchar', 'text', 'integer'))
+
+
+@read_query
+def _search_similar(word: str, lang: str = 'eng', limit: int = 5, owner: int = 0) -> tuple[Statement, tuple]:
+    return search_similar_statement, (owner, lang, word.lower(), limit)
+
+
+async def search_similar(word: str, lang: str = 'eng', limit: int = 5, owner: int = 0) -> list[str]:
+    """Похожие слова владельца по триграммам, самые близкие первыми"""
+    with primary(_recently_wrote(owner)):
+        results = await _search_similar(word, lang, limit, owner)
+    return [el[0] for el in results] if isinstance(results, list) else []
+
+
+insert_many_statement = Statement('insert_many', """WITH v (word, definition) AS (
+            SELECT * FROM unnest($3, $4)),
+        new_words AS (
+            INSERT INTO words (owner_id, lang, word) SELECT DISTINCT $1, $2, word FROM v
+            ON CONFLICT DO NOTHING RETURNING id, word),
+        new_definitions AS (
+            INSERT INTO definitions (lang, definition) SELECT DISTINCT $2, definition FROM v
+            ON CONFLICT DO NOTHING RETURNING id, definition),
+        term_words AS (
+            SELECT id, word FROM new_words
+            UNION ALL
+            SELECT id, word FROM words WHERE owner_id=$1 AND lang=$2 AND word IN (SELECT word FROM v)),
+        term_definitions AS (
+            SELECT id, definition FROM new_definitions
+            UNION ALL
+            SELECT id, definition FROM definitions WHERE lang=$2 AND definition IN (SELECT definition FROM v)),
+        links AS (
+            INSERT INTO link (word_id, definition_id)
+            SELECT DISTINCT term_words.id, term_definitions.id FROM v
+            JOIN term_words USING (word)
+            JOIN term_definitions USING (definition)
+            ON CONFLICT DO NOTHING RETURNING word_id, definition_id)
+        SELECT term_words.word, term_definitions.definition, links.word_id, links.definition_id
+        FROM links
+        JOIN term_words ON term_words.id=links.word_id
+        JOIN term_definitions ON term_definitions.id=links.definition_id""",
+                                  ('bigint', 'varchar', 'varchar[]', 'varchar[]'))
+
+
+def _insert_many(connection, rows: list[tuple[str, str]], lang: str = 'eng',
+                 owner: int = 0) -> list[tuple[str, str, int, int]]:
+    try:
+        with connection.cursor() as cursor:
+            insert_many_statement.execute(cursor, (owner, lang, [el[0] for el in rows], [el[1] for el in rows]))
+            results = cursor.fetchall()
+        connection.commit()
+    except psycopg2.Error as e:
+        connection.rollback()
+        logger.debug(f'Inserting {len(rows)} terms ({lang}) failed. Error message - {e}')
+        return []
+    return results
+
+
+async def insert_many(rows: list[tuple[str, str]], lang: str = 'eng',
+                      owner: int = 0) -> list[tuple[str, str, int, int]]:
+    """Добавление пачки пар (слово, определение) одним запросом. Возвращает только новые связи"""
+    if not rows:
+        return []
+    logger.info(f'Inserting {len(rows)} terms ({owner}, {lang}) to words, definitions, link')
+    results = await _run('insert_many', _insert_many, rows, lang, owner)
+    _wrote(owner)
+    for row in results:
+        cache.added((owner, lang), *row)
+    return results
+
+
+async def insert(word: str, definition: str, lang: str = 'eng', owner: int = 0) -> bool:
+    return bool(await insert_many([(word, definition)], lang, owner))
+
+
+async def insert_definitions(word: str, definitions: list[str], lang: str = 'eng',
+                             owner: int = 0) -> list[tuple[str, str, int, int]]:
+    return await insert_many([(word, definition) for definition in definitions], lang, owner)
+
+
+async def select_terms(word_ids: list[int], lang: str = 'eng', owner: int = 0) -> list[tuple[str, str]]:
+    """Слова по id с одним из определений. Удалённые слова пропускаются"""
+    language = await _dictionary(lang, owner)
+    return [term for term in map(language.term, word_ids) if term is not None]
+
+
+async def select_word_ids(words: list[str], lang: str = 'eng', owner: int = 0) -> list[int]:
+    language = await _dictionary(lang, owner)
+    return [word_id for word_id in map(language.word_id, words) if word_id is not None]
+
+
+select_reviews_statement = Statement('select_reviews', """SELECT user_id, word_id, repetitions, interval_days, ease
+        FROM reviews
+        WHERE (user_id, word_id) IN (SELECT * FROM unnest($1, $2))""", ('bigint[]', 'integer[]'))
+
+
+@strict_query
+def _select_reviews(keys: list[tuple[int, int]]) -> tuple[Statement, tuple]:
+    return select_reviews_statement, ([el[0] for el in keys], [el[1] for el in keys])
+
+
+async def select_reviews(keys: list[tuple[int, int]]) -> list[tuple[int, int, int, float, float]]:
+    """Текущее расписание повторений для пар (user_id, word_id)"""
+    results = await _select_reviews(keys)
+    return results if isinstance(results, list) else []
+
+
+upsert_reviews_statement = Statement('upsert_reviews', """INSERT INTO reviews
+            (user_id, word_id, repetitions, interval_days, ease, due_at, reviewed_at)
+        SELECT v.user_id, v.word_id, v.repetitions, v.interval_days, v.ease,
+            to_timestamp(v.due_at), to_timestamp(v.reviewed_at)
+        FROM unnest($1, $2, $3, $4, $5, $6, $7)
+            AS v (user_id, word_id, repetitions, interval_days, ease, due_at, reviewed_at)
+        JOIN words ON words.id=v.word_id
+        ON CONFLICT (user_id, word_id) DO UPDATE SET
+            repetitions=EXCLUDED.repetitions, interval_days=EXCLUDED.interval_days, ease=EXCLUDED.ease,
+            due_at=EXCLUDED.due_at, reviewed_at=EXCLUDED.reviewed_at""",
+                                     ('bigint[]', 'integer[]', 'integer[]', 'real[]', 'real[]',
+                                      'float8[]', 'float8[]'))
+
+
+@strict_query
+def upsert_reviews(rows: list[tuple[int, int, int, float, float, float, float]]) -> tuple[Statement, tuple]:
+    """Пакетная запись расписания: (user_id, word_id, repetitions, interval_days, ease, due_at, reviewed_at)"""
+    return upsert_reviews_statement, tuple(map(list, zip(*rows)))
+
+
+select_due_reviews_statement = Statement('select_due_reviews', """SELECT
+            reviews.word_id, extract(epoch FROM reviews.due_at)::float8
+        FROM reviews
+        JOIN words ON words.id=reviews.word_id
+        WHERE reviews.user_id=$1 AND reviews.due_at<=now() AND words.owner_id=$2 AND words.lang=$3
+        ORDER BY reviews.due_at
+        LIMIT $4""", ('bigint', 'bigint', 'varchar', 'integer'))
 
 
 @execute_query
-def select_last_n_terms(n: int, lang: str = 'eng') -> str:
-    return select_all_query(lang) + f' ORDER BY {lang}_words.id DESC LIMIT {n}'
+def _select_due_reviews(user_id: int, owner: int, lang: str, limit: int) -> tuple[Statement, tuple]:
+    return select_due_reviews_statement, (user_id, owner, lang, limit)
+
+
+async def select_due_reviews(user_id: int, lang: str = 'eng', limit: int = 50, owner: int = 0) -> list[tuple[int, float]]:
+    """Слова словаря owner, которые пора повторить: (word_id, due_at), самые просроченные первыми"""
+    results = await _select_due_reviews(user_id, owner, lang, limit)
+    return results if isinstance(results, list) else []
+
+
+select_translations_statement = Statement('select_translations', """UPDATE translation_cache SET used_at=now()
+        WHERE source=$1 AND dest=$2 AND word=ANY($3)
+        RETURNING word, translation""", ('varchar', 'varchar', 'varchar[]'))
 
 
 @execute_query
-def select_n_random(n: int, lang: str = 'eng') -> str:
-    query = select_all_query(lang) + f' ORDER BY RANDOM() LIMIT {n};'
-    return query
+def _select_translations(words: list[str], source: str, dest: str) -> tuple[Statement, tuple]:
+    return select_translations_statement, (source, dest, words)
+
+
+async def select_translations(words: list[str], source: str, dest: str) -> dict[str, str]:
+    results = await _select_translations(words, source, dest)
+    return dict(results) if isinstance(results, list) else {}
+
+
+@execute_query
+def insert_translations(translations: dict[str, str], source: str, dest: str) -> tuple[str, tuple]:
+    return ("""INSERT INTO translation_cache (source, dest, word, translation)
+            SELECT %s, %s, unnest(%s::text[]), unnest(%s::text[])
+            ON CONFLICT (source, dest, word) DO UPDATE SET translation=EXCLUDED.translation, used_at=now();""",
+            (source, dest, list(translations), list(translations.values())))
 
 
 @execute_query
-def select_all_definitions(word: str, lang: str = 'eng') -> str:
-    return select_all_query(lang) + f" WHERE word ILIKE $${word}$$ || '%';"
+def evict_translations(max_rows: int = 100000) -> tuple[str, tuple]:
+    """Удаление давно не использованных переводов сверх max_rows. Считает строки таблицы, вызывать изредка"""
+    return ("""DELETE FROM translation_cache WHERE ctid IN (
+                SELECT ctid FROM translation_cache ORDER BY used_at
+                LIMIT greatest((SELECT count(*) FROM translation_cache) - %s, 0));""", (max_rows,))
+
+
+select_fsm_statement = Statement('select_fsm', """SELECT state, data, bucket FROM fsm_storage
+        WHERE chat_id=$1 AND user_id=$2""", ('bigint', 'bigint'))
 
 
 @execute_query
-def _select_definition(word: str, lang: str = 'eng') -> str:
-    return f"""SELECT definition FROM {lang}_definitions WHERE word ILIKE $${word}$$ || '%';"""
+def _select_fsm(chat_id: int, user_id: int) -> tuple[Statement, tuple]:
+    return select_fsm_statement, (chat_id, user_id)
+
+
+async def select_fsm(chat_id: int, user_id: int) -> tuple[str | None, dict, dict] | None:
+    results = await _select_fsm(chat_id, user_id)
+    return results[0] if isinstance(results, list) and results else None
+
+
+upsert_fsm_statement = Statement('upsert_fsm', """INSERT INTO fsm_storage (chat_id, user_id, state, data, bucket)
+        SELECT chat_id, user_id, state, data::jsonb, bucket::jsonb FROM unnest($1, $2, $3, $4, $5)
+            AS v (chat_id, user_id, state, data, bucket)
+        ON CONFLICT (chat_id, user_id) DO UPDATE SET
+            state=EXCLUDED.state, data=EXCLUDED.data, bucket=EXCLUDED.bucket, updated_at=now()""",
+                                 ('bigint[]', 'bigint[]', 'varchar[]', 'text[]', 'text[]'))
+
+delete_fsm_statement = Statement('delete_fsm', """DELETE FROM fsm_storage
+        WHERE (chat_id, user_id) IN (SELECT * FROM unnest($1, $2))""", ('bigint[]', 'bigint[]'))
+
+
+def _upsert_fsm(connection, rows: list[tuple[int, int, str | None, str, str]], empty: list[tuple[int, int]]):
+    with connection.cursor() as cursor:
+        if rows:
+            chat_ids, user_ids, states, data, buckets = zip(*rows)
+            upsert_fsm_statement.execute(cursor, (list(chat_ids), list(user_ids), list(states), list(data), list(buckets)))
+        if empty:
+            chat_ids, user_ids = zip(*empty)
+            delete_fsm_statement.execute(cursor, (list(chat_ids), list(user_ids)))
+    connection.commit()
+    return True
+
+
+async def upsert_fsm(rows: list[tuple[int, int, str | None, str, str]], empty: list[tuple[int, int]]):
+    """Запись пачки состояний FSM (data и bucket уже в JSON) и удаление пустых состояний empty"""
+    return await _run('upsert_fsm', _upsert_fsm, rows, empty)
 
 
 @execute_query
-def insert(word: str, definition: str, lang: str = 'eng') -> list[str]:
-    logger.info(
-        f'Inserting {word.upper()} - {definition} ({lang}) to {lang}_words, {lang}_definitions, {lang}_link')
-    return [
-        f"""INSERT INTO {lang}_words (word) VALUES ($${word}$$);""",
-        f"""INSERT INTO {lang}_definitions (definition) VALUES ($${definition}$$);""",
-        f"""INSERT INTO {lang}_link VALUES (
-                (SELECT id FROM {lang}_words WHERE word = $${word}$$),
-                (SELECT id FROM {lang}_definitions WHERE definition=$${definition}$$));"""
-    ]
+def delete_expired_fsm(ttl: float) -> tuple[str, tuple]:
+    return """DELETE FROM fsm_storage WHERE updated_at < now() - make_interval(secs => %s);""", (ttl,)
+
+
+delete_statement = Statement('delete', """WITH deleted_words AS (
+            DELETE FROM words WHERE owner_id=$1 AND lang=$2 AND word=$3 RETURNING id),
+        deleted_links AS (
+            DELETE FROM link WHERE word_id IN (SELECT id FROM deleted_words) RETURNING definition_id),
+        deleted_definitions AS (
+            DELETE FROM definitions WHERE id IN (SELECT definition_id FROM deleted_links)
+            AND NOT EXISTS (
+                SELECT 1 FROM link
+                WHERE definition_id=definitions.id AND word_id NOT IN (SELECT id FROM deleted_words))
+            RETURNING id)
+        SELECT id FROM deleted_words""", ('bigint', 'varchar', 'varchar'))
 
 
 @execute_query
-def delete(word: str, lang: str = 'eng') -> list[str]:
-    logger.info(f'Deleting {word.upper()} ({lang}) ')
-    return [
-        f"""DELETE FROM {lang}_definitions WHERE id=
-                (SELECT definition_id FROM {lang}_link WHERE word_id=
-                    (SELECT id FROM {lang}_words WHERE word=$${word}$$));""",
-        f"""DELETE FROM {lang}_link WHERE word_id=
-                (SELECT id FROM {lang}_words WHERE word=$${word}$$);""",
-        f"""DELETE FROM {lang}_words WHERE word=$${word}$$;"""
-    ]
+def _delete(word: str, lang: str = 'eng', owner: int = 0) -> tuple[Statement, tuple]:
+    logger.info(f'Deleting {word.upper()} ({owner}, {lang}) ')
+    return delete_statement, (owner, lang, word)
+
+
+async def delete(word: str, lang: str = 'eng', owner: int = 0) -> bool:
+    """Удаление слова только из словаря owner"""
+    result = await _delete(word, lang, owner)
+    _wrote(owner)
+    cache.removed((owner, lang), word)
+    return isinstance(result, list) and bool(result)
+
+
+@strict_query
+def _copy_dictionary(lang: str, owner: int, source: int) -> tuple[str, tuple]:
+    return ("""WITH source_words AS (
+            SELECT id, word FROM words WHERE owner_id=%(source)s AND lang=%(lang)s),
+        new_words AS (
+            INSERT INTO words (owner_id, lang, word) SELECT %(owner)s, %(lang)s, word FROM source_words
+            ON CONFLICT DO NOTHING RETURNING id, word),
+        target_words AS (
+            SELECT id, word FROM new_words
+            UNION ALL
+            SELECT id, word FROM words
+            WHERE owner_id=%(owner)s AND lang=%(lang)s AND word IN (SELECT word FROM source_words))
+        INSERT INTO link (word_id, definition_id)
+        SELECT target_words.id, link.definition_id FROM target_words
+        JOIN source_words ON source_words.word=target_words.word
+        JOIN link ON link.word_id=source_words.id
+        ON CONFLICT DO NOTHING
+        RETURNING word_id;""", {'lang': lang, 'owner': owner, 'source': source})
+
+
+async def copy_dictionary(lang: str, owner: int, source: int = 0) -> int:
+    """Копирование словаря source (по умолчанию общего, владелец 0) в словарь owner. Возвращает число новых связей"""
+    results = await _copy_dictionary(lang, owner, source)
+    _wrote(owner)
+    cache.invalidate((owner, lang))
+    return len(results) if isinstance(results, list) else 0
+
+
+async def _main():
+    await init_pool()
+    try:
+        await init_db()
+        print(await select_all())
+    finally:
+        await close_pool()
 
 
 if __name__ == "__main__":
-    print(select_all())
+    asyncio.run(_main())
@@ -0,0 +1,85 @@
+CREATE TABLE IF NOT EXISTS languages (
+    code VARCHAR(10) PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS words (
+    id SERIAL PRIMARY KEY,
+    lang VARCHAR(10) NOT NULL REFERENCES languages(code) ON DELETE CASCADE ON UPDATE CASCADE,
+    word VARCHAR(50) NOT NULL,
+    UNIQUE (lang, word)
+);
+
+CREATE TABLE IF NOT EXISTS definitions (
+    id SERIAL PRIMARY KEY,
+    lang VARCHAR(10) NOT NULL REFERENCES languages(code) ON DELETE CASCADE ON UPDATE CASCADE,
+    definition VARCHAR(255) NOT NULL,
+    UNIQUE (lang, definition)
+);
+
+CREATE TABLE IF NOT EXISTS link (
+    word_id INTEGER NOT NULL,
+    definition_id INTEGER NOT NULL,
+    FOREIGN KEY (word_id) REFERENCES words(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (definition_id) REFERENCES definitions(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    UNIQUE (word_id, definition_id)
+);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS words_lang_id_idx ON words (lang, id);
+CREATE INDEX IF NOT EXISTS words_lang_lower_word_prefix_idx ON words (lang, lower(word) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS words_lower_word_trgm_idx ON words USING gin (lower(word) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS link_definition_id_idx ON link (definition_id);
+
+-- Перенос словарей из старых таблиц {lang}_words, {lang}_definitions, {lang}_link
+DO $$
+DECLARE
+    old RECORD;
+BEGIN
+    FOR old IN
+        SELECT left(tablename, -length('_link')) AS code FROM pg_tables
+        WHERE schemaname = current_schema() AND tablename LIKE '%\_link' AND tablename <> 'link'
+    LOOP
+        IF to_regclass(old.code || '_words') IS NULL OR to_regclass(old.code || '_definitions') IS NULL THEN
+            CONTINUE;
+        END IF;
+        INSERT INTO languages (code) VALUES (old.code) ON CONFLICT DO NOTHING;
+        EXECUTE format('INSERT INTO words (lang, word) SELECT %L, word FROM %I ORDER BY id ON CONFLICT DO NOTHING',
+                       old.code, old.code || '_words');
+        EXECUTE format('INSERT INTO definitions (lang, definition) SELECT %L, definition FROM %I ORDER BY id '
+                       'ON CONFLICT DO NOTHING', old.code, old.code || '_definitions');
+        EXECUTE format('INSERT INTO link (word_id, definition_id) '
+                       'SELECT words.id, definitions.id FROM %1$I old_link '
+                       'JOIN %2$I old_words ON old_words.id=old_link.word_id '
+                       'JOIN %3$I old_definitions ON old_definitions.id=old_link.definition_id '
+                       'JOIN words ON words.lang=%4$L AND words.word=old_words.word '
+                       'JOIN definitions ON definitions.lang=%4$L AND definitions.definition=old_definitions.definition '
+                       'ON CONFLICT DO NOTHING',
+                       old.code || '_link', old.code || '_words', old.code || '_definitions', old.code);
+        EXECUTE format('DROP TABLE %I, %I, %I', old.code || '_link', old.code || '_words', old.code || '_definitions');
+    END LOOP;
+END $$;
+
+INSERT INTO languages (code)
+VALUES
+  ('eng'),
+  ('ru')
+ON CONFLICT DO NOTHING;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM words WHERE lang = 'eng') THEN
+        RETURN;
+    END IF;
+    INSERT INTO words (lang, word) VALUES ('eng', 'book');
+    INSERT INTO definitions (lang, definition)
+    VALUES
+      ('eng', 'книга'),
+      ('eng', 'бронировать');
+    INSERT INTO link (word_id, definition_id)
+    VALUES
+      ((SELECT id FROM words WHERE lang = 'eng' AND word = 'book'),
+      (SELECT id FROM definitions WHERE lang = 'eng' AND definition = 'книга')),
+      ((SELECT id FROM words WHERE lang = 'eng' AND word = 'book'),
+      (SELECT id FROM definitions WHERE lang = 'eng' AND definition = 'бронировать'));
+END $$;
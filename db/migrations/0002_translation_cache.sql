@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS translation_cache (
+    source VARCHAR(10) NOT NULL,
+    dest VARCHAR(10) NOT NULL,
+    word VARCHAR(50) NOT NULL,
+    translation VARCHAR(255) NOT NULL,
+    used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (source, dest, word)
+);
+
+CREATE INDEX IF NOT EXISTS translation_cache_used_at_idx ON translation_cache (used_at);
@@ -0,0 +1,11 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS fsm_storage (
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    state VARCHAR(255),
+    data JSONB NOT NULL DEFAULT '{}',
+    bucket JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS fsm_storage_updated_at_idx ON fsm_storage (updated_at);
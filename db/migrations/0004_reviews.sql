@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS reviews (
+    user_id BIGINT NOT NULL,
+    word_id INTEGER NOT NULL REFERENCES words(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    repetitions INTEGER NOT NULL DEFAULT 0,
+    interval_days REAL NOT NULL DEFAULT 0,
+    ease REAL NOT NULL DEFAULT 2.5,
+    due_at TIMESTAMPTZ NOT NULL,
+    reviewed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, word_id)
+);
+
+CREATE INDEX IF NOT EXISTS reviews_user_id_due_at_idx ON reviews (user_id, due_at);
@@ -0,0 +1,17 @@
+ALTER TABLE words ADD COLUMN IF NOT EXISTS owner_id BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE words DROP CONSTRAINT IF EXISTS words_lang_word_key;
+ALTER TABLE words DROP CONSTRAINT IF EXISTS words_owner_id_lang_word_key;
+ALTER TABLE words ADD CONSTRAINT words_owner_id_lang_word_key UNIQUE (owner_id, lang, word);
+
+DROP INDEX IF EXISTS words_lang_id_idx;
+DROP INDEX IF EXISTS words_lang_lower_word_prefix_idx;
+DROP INDEX IF EXISTS words_lower_word_trgm_idx;
+
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE INDEX IF NOT EXISTS words_owner_id_lang_id_idx ON words (owner_id, lang, id);
+CREATE INDEX IF NOT EXISTS words_owner_id_lang_lower_word_prefix_idx
+    ON words (owner_id, lang, lower(word) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS words_owner_id_lower_word_trgm_idx
+    ON words USING gin (owner_id, lower(word) gin_trgm_ops);
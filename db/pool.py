@@ -0,0 +1,176 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+from loguru import logger
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+async def _wait_done(future: asyncio.Future):
+    """Ожидание future, которое нельзя прервать отменой ждущей задачи"""
+    while not future.done():
+        try:
+            await asyncio.wait([future])
+        except asyncio.CancelledError:
+            pass
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.acquired: int = 0
+        self.timeouts: int = 0
+        self.broken: int = 0
+        self.waiting: int = 0
+        self.wait_total: float = 0.0
+        self.wait_max: float = 0.0
+
+    def record_wait(self, seconds: float):
+        self.acquired += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    @property
+    def wait_avg(self) -> float:
+        return self.wait_total / self.acquired if self.acquired else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'acquired': self.acquired,
+            'timeouts': self.timeouts,
+            'broken': self.broken,
+            'waiting': self.waiting,
+            'wait_total': self.wait_total,
+            'wait_avg': self.wait_avg,
+            'wait_max': self.wait_max
+        }
+
+
+class Pool:
+    """Ограниченный пул соединений psycopg2, работающий вне event loop"""
+
+    def __init__(self,
+                 min_size: int = 1,
+                 max_size: int = 10,
+                 timeout: float = 5.0,
+                 health_check_interval: float = 30.0,
+                 **dsn):
+        self.min_size: int = min_size
+        self.max_size: int = max_size
+        self.timeout: float = timeout
+        self.health_check_interval: float = health_check_interval
+        self.dsn: dict = dsn
+        self.stats: PoolStats = PoolStats()
+        self._pool: ThreadedConnectionPool | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._checked_at: dict[int, float] = {}
+
+    async def _run(self, fn, *args):
+        """fn(*args) в потоке пула. При отмене сначала дожидается потока: иначе соединение
+        вернулось бы в пул, пока поток ещё работает с ним"""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await _wait_done(future)
+            raise
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='db')
+        self._semaphore = asyncio.Semaphore(self.max_size)
+        try:
+            self._pool = await self._run(lambda: ThreadedConnectionPool(self.min_size, self.max_size, **self.dsn))
+        except Exception:
+            self._executor.shutdown(wait=False)
+            raise
+        logger.info(f'Connection pool opened ({self.min_size}-{self.max_size} connections)')
+
+    @property
+    def opened(self) -> bool:
+        return self._pool is not None
+
+    async def close(self):
+        if self._pool is None:
+            return
+        await self._run(self._pool.closeall)
+        self._executor.shutdown(wait=True)
+        self._pool = None
+        logger.info(f'Connection pool closed. Stats: {self.stats.as_dict()}')
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _getconn(self):
+        connection = self._pool.getconn()
+        now = time.monotonic()
+        if now - self._checked_at.get(id(connection), 0) > self.health_check_interval:
+            while not self._is_alive(connection):
+                logger.warning('Dropping broken connection from pool')
+                self.stats.broken += 1
+                self._checked_at.pop(id(connection), None)
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+            self._checked_at[id(connection)] = now
+        return connection
+
+    def _putconn(self, connection):
+        if not connection.closed and connection.status != psycopg2.extensions.STATUS_READY:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+        if connection.closed:
+            self._checked_at.pop(id(connection), None)
+        self._pool.putconn(connection, close=bool(connection.closed))
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._pool is None:
+            raise RuntimeError('Connection pool is not opened')
+        start = time.monotonic()
+        self.stats.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            raise PoolTimeout(f'No free connection in {self.timeout}s')
+        finally:
+            self.stats.waiting -= 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, self._getconn)
+            try:
+                connection = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                await _wait_done(future)
+                if future.exception() is None:
+                    await self._run(self._putconn, future.result())
+                raise
+            self.stats.record_wait(time.monotonic() - start)
+            try:
+                yield connection
+            finally:
+                await self._run(self._putconn, connection)
+        finally:
+            self._semaphore.release()
+
+    async def run(self, fn, *args):
+        """Выполнение fn(connection, *args) в потоке пула"""
+        async with self.acquire() as connection:
+            return await self._run(fn, connection, *args)
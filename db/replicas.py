@@ -0,0 +1,92 @@
+"""Реплики Postgres для чтения.
+
+Запросы на чтение распределяются по кругу между здоровыми репликами. Реплика считается
+здоровой, если отвечает и отстаёт от основного сервера не больше чем на max_lag секунд.
+Проверка идёт в фоне раз в check_interval секунд; реплика, на которой упал запрос,
+исключается до следующей успешной проверки. Если здоровых реплик нет, читаем с основного.
+"""
+import asyncio
+import itertools
+
+import psycopg2
+from loguru import logger
+
+from db.pool import Pool, PoolTimeout
+
+LAG_SQL = """SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END"""
+
+
+def _lag(connection) -> float:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+    finally:
+        connection.rollback()
+
+
+class Replicas:
+
+    def __init__(self, dsns: list[str], max_lag: float = 5.0, check_interval: float = 5.0, **pool_kwargs):
+        self.max_lag: float = max_lag
+        self.check_interval: float = check_interval
+        self.pools: list[Pool] = [Pool(dsn=dsn, **pool_kwargs) for dsn in dsns]
+        self.healthy: list[bool] = [False] * len(self.pools)
+        self.lag: list[float | None] = [None] * len(self.pools)
+        self._next = itertools.count()
+        self._checker: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.pools)
+
+    async def open(self):
+        await self.check()
+        self._checker = asyncio.create_task(self._check_forever())
+        logger.info(f'Replicas opened: {sum(self.healthy)}/{len(self.pools)} healthy')
+
+    async def close(self):
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        for pool in self.pools:
+            await pool.close()
+
+    def pool(self) -> Pool | None:
+        """Следующая здоровая реплика по кругу или None"""
+        for _ in range(len(self.pools)):
+            i = next(self._next) % len(self.pools)
+            if self.healthy[i]:
+                return self.pools[i]
+        return None
+
+    def failed(self, pool: Pool, error: Exception):
+        i = self.pools.index(pool)
+        if self.healthy[i]:
+            logger.warning(f'Replica {i} failed, reading from primary until next check: {error}')
+        self.healthy[i] = False
+
+    async def _check(self, i: int):
+        pool = self.pools[i]
+        try:
+            if not pool.opened:
+                await pool.open()
+            self.lag[i] = await asyncio.wait_for(pool.run(_lag), pool.timeout)
+        except (psycopg2.Error, PoolTimeout, asyncio.TimeoutError, OSError) as e:
+            (logger.warning if self.healthy[i] else logger.debug)(f'Replica {i} is unavailable: {e}')
+            self.healthy[i], self.lag[i] = False, None
+            return
+        healthy = self.lag[i] <= self.max_lag
+        if healthy != self.healthy[i]:
+            logger.info(f'Replica {i} is {"healthy" if healthy else "lagging"}, lag {self.lag[i]:.1f}s')
+        self.healthy[i] = healthy
+
+    async def check(self):
+        await asyncio.gather(*(self._check(i) for i in range(len(self.pools))))
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
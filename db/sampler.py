@@ -0,0 +1,62 @@
+import random
+from array import array
+
+
+class LinkSampler:
+    """Компактный массив пар (word_id, definition_id) для случайной выборки за O(1) на элемент"""
+
+    def __init__(self):
+        self.word_ids: array = array('q')
+        self.definition_ids: array = array('q')
+        self._positions: dict[tuple[int, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def add(self, word_id: int, definition_id: int) -> bool:
+        if (word_id, definition_id) in self._positions:
+            return False
+        self._positions[(word_id, definition_id)] = len(self.word_ids)
+        self.word_ids.append(word_id)
+        self.definition_ids.append(definition_id)
+        return True
+
+    def remove(self, word_id: int, definition_id: int) -> bool:
+        i = self._positions.pop((word_id, definition_id), None)
+        if i is None:
+            return False
+        last_word_id, last_definition_id = self.word_ids.pop(), self.definition_ids.pop()
+        if i < len(self.word_ids):
+            self.word_ids[i], self.definition_ids[i] = last_word_id, last_definition_id
+            self._positions[(last_word_id, last_definition_id)] = i
+        return True
+
+    def _positions_in_random_order(self, n: int):
+        size = len(self.word_ids)
+        if n * 2 >= size:
+            yield from random.sample(range(size), size)
+            return
+        seen = set()
+        while len(seen) < size:
+            i = random.randrange(size)
+            if i not in seen:
+                seen.add(i)
+                yield i
+
+    def sample(self, n: int, distinct: bool = False) -> list[tuple[int, int]]:
+        """Выборка n различных пар. При distinct=True слова и определения в выборке не повторяются"""
+        result = []
+        if n <= 0:
+            return result
+        word_ids, definition_ids = set(), set()
+        for i in self._positions_in_random_order(n):
+            word_id, definition_id = self.word_ids[i], self.definition_ids[i]
+            if distinct:
+                if word_id in word_ids or definition_id in definition_ids:
+                    continue
+                word_ids.add(word_id)
+                definition_ids.add(definition_id)
+            result.append((word_id, definition_id))
+            if len(result) == n:
+                break
+        return result
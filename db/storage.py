@@ -0,0 +1,174 @@
+import asyncio
+import copy
+import json
+import os
+import typing
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
+from loguru import logger
+
+import db.db as db
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'bucket', 'dirty')
+
+    def __init__(self, state: str | None = None, data: dict = None, bucket: dict = None):
+        self.state: str | None = state
+        self.data: dict = data or {}
+        self.bucket: dict = bucket or {}
+        self.dirty: bool = False
+
+
+class PostgresStorage(BaseStorage):
+    """FSM в UNLOGGED-таблице Postgres.
+
+    Записи читаются из БД при первом обращении в рамках апдейта и держатся в памяти,
+    пока не будут записаны: все изменения за апдейт уходят в БД одним пакетом
+    (см. StorageFlushMiddleware). Заброшенные состояния удаляются по TTL.
+    """
+
+    def __init__(self, ttl: float = 7 * 24 * 3600, sweep_interval: float = 3600):
+        self.ttl: float = ttl
+        self.sweep_interval: float = sweep_interval
+        self._records: dict[tuple[int, int], _Record] = {}
+        self._loading: dict[tuple[int, int], asyncio.Task] = {}
+        self._sweeper: asyncio.Task | None = None
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await db.delete_expired_fsm(self.ttl)
+            except Exception as e:
+                logger.warning(f'FSM storage sweep failed: {e}')
+
+    async def _record(self, chat, user) -> _Record:
+        chat, user = self.check_address(chat=chat, user=user)
+        key = (int(chat), int(user))
+        record = self._records.get(key)
+        if record is not None:
+            return record
+        if key not in self._loading:
+            self._loading[key] = asyncio.create_task(db.select_fsm(*key))
+        try:
+            row = await self._loading[key]
+        finally:
+            self._loading.pop(key, None)
+        return self._records.setdefault(key, _Record(*row) if row else _Record())
+
+    async def flush(self):
+        """Пакетная запись всех изменённых записей. Чистые записи выгружаются из памяти.
+
+        Записи сериализуются здесь, до передачи в поток БД: обработчики могут менять их во время записи.
+        """
+        dirty = {key: record for key, record in self._records.items() if record.dirty}
+        for key in [key for key, record in self._records.items() if not record.dirty]:
+            del self._records[key]
+        if not dirty:
+            return
+        rows, empty = [], []
+        for key, record in dirty.items():
+            record.dirty = False
+            if record.state or record.data or record.bucket:
+                rows.append((*key, record.state, json.dumps(record.data), json.dumps(record.bucket)))
+            else:
+                empty.append(key)
+        try:
+            await db.upsert_fsm(rows, empty)
+        except Exception:
+            for record in dirty.values():
+                record.dirty = True
+            raise
+        for key, record in dirty.items():
+            if not record.dirty and self._records.get(key) is record:
+                del self._records[key]
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._record(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        record = await self._record(chat, user)
+        return copy.deepcopy(record.data) if record.data else (default or {})
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        record = await self._record(chat, user)
+        record.state = self.resolve_state(state)
+        record.dirty = True
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = await self._record(chat, user)
+        record.data = copy.deepcopy(data) if data else {}
+        record.dirty = True
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        record = await self._record(chat, user)
+        record.data.update(copy.deepcopy(data) if data else {}, **kwargs)
+        record.dirty = True
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._record(chat, user)
+        return copy.deepcopy(record.bucket) if record.bucket else (default or {})
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = await self._record(chat, user)
+        record.bucket = copy.deepcopy(bucket) if bucket else {}
+        record.dirty = True
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        record = await self._record(chat, user)
+        record.bucket.update(copy.deepcopy(bucket) if bucket else {}, **kwargs)
+        record.dirty = True
+
+
+class StorageFlushMiddleware(BaseMiddleware):
+    """Запись изменений FSM одним запросом после обработки каждого апдейта"""
+
+    def __init__(self, storage: PostgresStorage):
+        super().__init__()
+        self.storage: PostgresStorage = storage
+
+    async def on_post_process_update(self, update, results, data: dict):
+        await self.storage.flush()
+
+
+def create_storage() -> BaseStorage:
+    if os.getenv('FSM_STORAGE', 'postgres') == 'memory':
+        return MemoryStorage()
+    return PostgresStorage(ttl=float(os.getenv('FSM_STATE_TTL', 7 * 24 * 3600)),
+                           sweep_interval=float(os.getenv('FSM_SWEEP_INTERVAL', 3600)))
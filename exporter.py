@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+from typing import Awaitable, BinaryIO, Callable
+
+import db.db as db
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+FORMATS = ('csv', 'jsonl', 'text')
+
+
+async def iter_terms(lang: str, batch_size: int = 1000, owner: int = 0):
+    """Пары (слово, определения) словаря owner по порядку, без загрузки словаря целиком"""
+    word, definitions = None, []
+    async for rows in db.stream_all(lang, batch_size, owner):
+        for row_word, definition in rows:
+            if row_word != word:
+                if word is not None:
+                    yield word, definitions
+                word, definitions = row_word, []
+            definitions.append(definition)
+    if word is not None:
+        yield word, definitions
+
+
+async def iter_pages(lang: str, format_term: Callable[[str, list[str]], str],
+                     limit: int = TELEGRAM_MESSAGE_LIMIT, owner: int = 0):
+    """Текст словаря, разбитый на сообщения не длиннее limit"""
+    page = ''
+    async for word, definitions in iter_terms(lang, owner=owner):
+        line = format_term(word, definitions)[:limit]
+        if page and len(page) + 1 + len(line) > limit:
+            yield page
+            page = ''
+        page = page + '\n' + line if page else line
+    if page:
+        yield page
+
+
+async def write_file(lang: str, file: BinaryIO, format_: str = 'csv',
+                     run_io: Callable[..., Awaitable] = None, batch_size: int = 1000,
+                     owner: int = 0) -> int:
+    """Запись словаря в файл в формате csv (одна пара на строку, как при импорте) или jsonl (одно слово на строку).
+
+    Строки копятся пачками по batch_size слов, запись пачки в файл идёт через run_io (например, в пуле потоков).
+    """
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    async def flush():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        if run_io is not None:
+            await run_io(file.write, data)
+        else:
+            file.write(data)
+
+    async for word, definitions in iter_terms(lang, batch_size, owner):
+        if format_ == 'jsonl':
+            buffer.write(json.dumps({'word': word, 'definitions': definitions}, ensure_ascii=False) + '\n')
+        else:
+            writer.writerows([word, definition] for definition in definitions)
+        count += 1
+        if count % batch_size == 0:
+            await flush()
+    await flush()
+    return count
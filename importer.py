@@ -0,0 +1,176 @@
+import asyncio
+import codecs
+import csv
+import io
+import time
+from typing import Awaitable, BinaryIO, Callable
+
+from loguru import logger
+
+import db.db as db
+
+WORD_MAX_LENGTH = 50
+DEFINITION_MAX_LENGTH = 255
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.started_at: float = time.monotonic()
+        self.rows: int = 0
+        self.duplicates: int = 0
+        self.skipped: int = 0
+        self.translated: int = 0
+        self.untranslated: int = 0
+        self.inserted: int = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        s = f'Обработано строк: {self.rows} ({self.rate:.0f} строк/с)\nДобавлено: {self.inserted}'
+        if self.duplicates:
+            s += f'\nПовторов: {self.duplicates}'
+        if self.translated or self.untranslated:
+            s += f'\nПереведено: {self.translated}'
+        if self.untranslated:
+            s += f', не удалось перевести: {self.untranslated}'
+        if self.skipped:
+            s += f'\nПропущено: {self.skipped}'
+        return s
+
+
+class ParsedCsv:
+    """Результат разбора CSV: пары для вставки и слова без перевода"""
+    __slots__ = ('terms', 'words', 'rows', 'duplicates', 'skipped')
+
+    def __init__(self):
+        self.terms: list[tuple[str, str]] = []
+        self.words: list[str] = []
+        self.rows: int = 0
+        self.duplicates: int = 0
+        self.skipped: int = 0
+
+
+def parse_csv(data: bytes) -> ParsedCsv:
+    """Разбор и проверка строк CSV без обращения к БД, подходит для запуска в отдельном процессе"""
+    parsed = ParsedCsv()
+    seen_terms: set[tuple[str, str]] = set()
+    seen_words: set[str] = set()
+    for row in csv.reader(codecs.iterdecode(io.BytesIO(data), 'utf-8-sig'), delimiter=',', skipinitialspace=True):
+        parsed.rows += 1
+        row = [el.strip() for el in row]
+        if not row or not row[0] or len(row) > 2 or len(row[0]) > WORD_MAX_LENGTH:
+            parsed.skipped += 1
+            continue
+        word = row[0].lower()
+        if len(row) == 1 or not row[1]:
+            if word in seen_words:
+                parsed.duplicates += 1
+                continue
+            seen_words.add(word)
+            parsed.words.append(word)
+        else:
+            if len(row[1]) > DEFINITION_MAX_LENGTH:
+                parsed.skipped += 1
+                continue
+            if (word, row[1]) in seen_terms:
+                parsed.duplicates += 1
+                continue
+            seen_terms.add((word, row[1]))
+            parsed.terms.append((word, row[1]))
+    return parsed
+
+
+async def import_csv(buffer: BinaryIO,
+                     lang: str,
+                     translate: Callable[[list[str]], Awaitable[list[str]]],
+                     progress: Callable[[ImportStats], Awaitable] = None,
+                     owner: int = 0,
+                     **kwargs) -> ImportStats:
+    """Разбор CSV в event loop и импорт. Для больших файлов лучше parse_csv в пуле процессов и import_parsed"""
+    return await import_parsed(parse_csv(buffer.read()), lang, translate, progress, owner, **kwargs)
+
+
+async def import_parsed(parsed: ParsedCsv,
+                        lang: str,
+                        translate: Callable[[list[str]], Awaitable[list[str]]],
+                        progress: Callable[[ImportStats], Awaitable] = None,
+                        owner: int = 0,
+                        chunk_size: int = 1000,
+                        translate_batch: int = 50,
+                        translate_workers: int = 4,
+                        progress_interval: float = 3.0) -> ImportStats:
+    """Параллельный пакетный перевод слов без определений и пакетная вставка в словарь owner"""
+    stats = ImportStats()
+    stats.rows, stats.duplicates, stats.skipped = parsed.rows, parsed.duplicates, parsed.skipped
+    seen_terms: set[tuple[str, str]] = set(parsed.terms)
+    insert_queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+    translate_queue: asyncio.Queue = asyncio.Queue(maxsize=translate_workers * 2)
+    reported_at = time.monotonic()
+
+    async def report():
+        nonlocal reported_at
+        if progress is not None and time.monotonic() - reported_at > progress_interval:
+            reported_at = time.monotonic()
+            try:
+                await progress(stats)
+            except Exception as e:
+                logger.debug(f'Import progress report failed: {e}')
+
+    async def inserter():
+        while (chunk := await insert_queue.get()) is not None:
+            stats.inserted += len(await db.insert_many(chunk, lang, owner))
+            await report()
+
+    async def translator():
+        while (words := await translate_queue.get()) is not None:
+            try:
+                translations = await translate(words)
+            except Exception as e:
+                logger.warning(f'Translation of {len(words)} words failed: {e}')
+                stats.untranslated += len(words)
+                continue
+            chunk = []
+            for word, definition in zip(words, translations):
+                definition = (definition or '').strip()
+                if not definition or len(definition) > DEFINITION_MAX_LENGTH or (word, definition) in seen_terms:
+                    stats.untranslated += 1
+                    continue
+                seen_terms.add((word, definition))
+                chunk.append((word, definition))
+            stats.translated += len(chunk)
+            await insert_queue.put(chunk)
+
+    async def feed_translators():
+        for i in range(0, len(parsed.words), translate_batch):
+            await translate_queue.put(parsed.words[i:i + translate_batch])
+        for _ in translate_tasks:
+            await translate_queue.put(None)
+
+    async def produce():
+        for i in range(0, len(parsed.terms), chunk_size):
+            await insert_queue.put(parsed.terms[i:i + chunk_size])
+        await feed_task
+        await asyncio.gather(*translate_tasks)
+        await insert_queue.put(None)
+
+    insert_task = asyncio.create_task(inserter())
+    translate_tasks = [asyncio.create_task(translator()) for _ in range(translate_workers)]
+    feed_task = asyncio.create_task(feed_translators())
+    produce_task = asyncio.create_task(produce())
+    try:
+        # если вставка упала, производители иначе навсегда повиснут на полной очереди
+        done, _ = await asyncio.wait([insert_task, produce_task], return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in [insert_task, produce_task, feed_task, *translate_tasks]:
+            task.cancel()
+    logger.info(f'Import to ({owner}, {lang}) finished in {stats.elapsed:.1f}s: {stats.rows} rows, {stats.inserted} inserted')
+    return stats
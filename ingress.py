@@ -0,0 +1,128 @@
+"""Приём апдейтов через вебхук с ограниченной параллельной обработкой.
+
+Апдейты одного чата обрабатываются строго по очереди, разных чатов - параллельно,
+не больше WEBHOOK_CONCURRENCY одновременно.
+
+Бот рассчитан на один экземпляр. Сессии викторин, очереди повторений, фоновые задачи
+и кэш словарей живут в памяти процесса, а кэш обновляется только записями этого же
+процесса. За балансировщиком с несколькими экземплярами ответ на опрос, попавший
+в другой экземпляр, теряется, а слово, добавленное через один экземпляр, не видно
+в другом. Несколько экземпляров возможны, только если все апдейты одного пользователя
+и всех его чатов всегда попадают в один и тот же экземпляр.
+
+Локально можно проверить так:
+
+    BOT_MODE=webhook WEBHOOK_URL=http://localhost:8080 python main.py
+    curl -X POST localhost:8080/webhook -H 'Content-Type: application/json' -d @update.json
+"""
+import asyncio
+import os
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+from loguru import logger
+
+import metrics
+
+UPDATE_QUEUE_KEY = 'UPDATE_QUEUE'
+
+
+def _chat_id(update: types.Update) -> int | None:
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        return update.callback_query.from_user.id
+    if update.poll_answer is not None:
+        return update.poll_answer.user.id
+    return None
+
+
+class UpdateQueue:
+
+    def __init__(self, dispatcher: Dispatcher, concurrency: int = 32, max_pending: int = 1000):
+        self.dispatcher: Dispatcher = dispatcher
+        self.max_pending: int = max_pending
+        self.pending: int = 0
+        self.closing: bool = False
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+        self._tails: dict[int | None, asyncio.Task] = {}
+        self._idle: asyncio.Event = asyncio.Event()
+        self._idle.set()
+
+    def put(self, update: types.Update) -> bool:
+        """False, если очередь переполнена или закрывается: Telegram повторит запрос позже"""
+        if self.closing or self.pending >= self.max_pending:
+            return False
+        chat_id = _chat_id(update)
+        self.pending += 1
+        self._idle.clear()
+        self._tails[chat_id] = asyncio.create_task(self._process(chat_id, update, self._tails.get(chat_id)))
+        return True
+
+    async def _process(self, chat_id: int | None, update: types.Update, previous: asyncio.Task | None):
+        try:
+            if previous is not None:
+                await previous
+            async with self._semaphore:
+                await self.dispatcher.updates_handler.notify(update)
+        except Exception as e:
+            logger.exception(f'Update {update.update_id} failed: {e}')
+        finally:
+            self.pending -= 1
+            if self._tails.get(chat_id) is asyncio.current_task():
+                del self._tails[chat_id]
+            if not self.pending:
+                self._idle.set()
+
+    async def drain(self, timeout: float = 30):
+        self.closing = True
+        if self.pending:
+            logger.info(f'Waiting for {self.pending} updates to finish')
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'{self.pending} updates were not processed before shutdown')
+
+
+class QueuedWebhookRequestHandler(WebhookRequestHandler):
+    """Отвечает Telegram сразу, обработка апдейта идёт в UpdateQueue"""
+
+    async def post(self):
+        self.validate_ip()
+        secret = os.getenv('WEBHOOK_SECRET')
+        if secret and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            raise web.HTTPUnauthorized()
+        dispatcher = self.get_dispatcher()
+        update = await self.parse_update(dispatcher.bot)
+        if not self.request.app[UPDATE_QUEUE_KEY].put(update):
+            return web.Response(status=503)
+        return web.Response(text='ok')
+
+
+def start_webhook(dispatcher: Dispatcher, on_startup, on_shutdown):
+    path = os.getenv('WEBHOOK_PATH', '/webhook')
+    queue = UpdateQueue(dispatcher,
+                        concurrency=int(os.getenv('WEBHOOK_CONCURRENCY', 32)),
+                        max_pending=int(os.getenv('WEBHOOK_MAX_PENDING', 1000)))
+    metrics.registry.gauge('dict_webhook_pending_updates', 'Updates accepted but not processed yet',
+                           lambda: {(): queue.pending})
+
+    async def startup(dp: Dispatcher):
+        await on_startup(dp)
+        url = os.getenv('WEBHOOK_URL')
+        if url:
+            await dp.bot.set_webhook(url.rstrip('/') + path, secret_token=os.getenv('WEBHOOK_SECRET'))
+
+    async def shutdown(dp: Dispatcher):
+        await queue.drain(float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30)))
+        await on_shutdown(dp)
+
+    executor = Executor(dispatcher, skip_updates=False)
+    executor.on_startup(startup)
+    executor.on_shutdown(shutdown)
+    executor.set_webhook(webhook_path=path, request_handler=QueuedWebhookRequestHandler)
+    executor.web_app[UPDATE_QUEUE_KEY] = queue
+    executor.run_app(host=os.getenv('WEBAPP_HOST', '0.0.0.0'), port=int(os.getenv('WEBAPP_PORT', 8080)))
@@ -0,0 +1,195 @@
+"""Фоновые задачи пользователей: импорт и выгрузка словаря.
+
+Обработчик только ставит задачу в очередь и сразу отвечает, задача выполняется
+одним из воркеров. Тяжёлые по CPU шаги задача отдаёт в пул процессов (cpu),
+блокирующий ввод-вывод - в пул потоков (io). Очередь ограничена, у пользователя
+не больше per_user активных задач.
+"""
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+import metrics
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+STATE_NAMES = {
+    QUEUED: 'в очереди',
+    RUNNING: 'выполняется',
+    DONE: 'завершена',
+    FAILED: 'ошибка',
+    CANCELLED: 'отменена'
+}
+
+job_seconds = metrics.registry.histogram('dict_job_seconds', 'Background job run time', ('state',))
+
+
+class JobRejected(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ('id', 'user_id', 'title', 'run', 'on_finish', 'state', 'progress', 'result', 'error',
+                 'created_at', 'started_at', 'finished_at', 'task')
+
+    def __init__(self, id_: int, user_id: int, title: str,
+                 run: Callable[['Job'], Awaitable],
+                 on_finish: Callable[['Job'], Awaitable] = None):
+        self.id: int = id_
+        self.user_id: int = user_id
+        self.title: str = title
+        self.run: Callable[['Job'], Awaitable] = run
+        self.on_finish: Callable[['Job'], Awaitable] | None = on_finish
+        self.state: str = QUEUED
+        self.progress: str = ''
+        self.result = None
+        self.error: BaseException | None = None
+        self.created_at: float = time.monotonic()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+    def __str__(self) -> str:
+        s = f'#{self.id} {self.title}: {STATE_NAMES[self.state]}'
+        if self.started_at is not None:
+            s += f', {(self.finished_at or time.monotonic()) - self.started_at:.0f} с'
+        if self.progress and self.active:
+            s += '\n' + self.progress
+        return s
+
+
+class JobRunner:
+
+    def __init__(self, workers: int = 2, max_queue: int = 20, per_user: int = 1,
+                 process_workers: int | None = None, thread_workers: int = 4,
+                 history: int = 5, max_users: int = 10000):
+        self.workers: int = workers
+        self.per_user: int = per_user
+        self.process_workers: int | None = process_workers
+        self.thread_workers: int = thread_workers
+        self.history: int = history
+        self.max_users: int = max_users
+        self._ids = itertools.count(1)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._jobs: OrderedDict[int, deque[Job]] = OrderedDict()
+        self._workers: list[asyncio.Task] = []
+        self._processes: ProcessPoolExecutor | None = None
+        self._threads: ThreadPoolExecutor | None = None
+        metrics.registry.gauge('dict_jobs', 'Background jobs by state',
+                               lambda: {(QUEUED,): self._queue.qsize(), (RUNNING,): self.running}, ('state',))
+
+    @property
+    def running(self) -> int:
+        return sum(1 for jobs in self._jobs.values() for job in jobs if job.state == RUNNING)
+
+    async def start(self):
+        """Запуск воркеров. Процессы пула создаются сразу, пока в процессе мало потоков"""
+        if self._workers:
+            return
+        self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+        self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix='jobs')
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._processes, int)
+                               for _ in range(self.process_workers or os.cpu_count() or 1)))
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def cpu(self, fn, *args):
+        """fn(*args) в пуле процессов. fn и аргументы должны сериализоваться pickle"""
+        return await asyncio.get_running_loop().run_in_executor(self._processes, fn, *args)
+
+    async def io(self, fn, *args):
+        """fn(*args) в пуле потоков"""
+        return await asyncio.get_running_loop().run_in_executor(self._threads, fn, *args)
+
+    def jobs(self, user_id: int) -> list[Job]:
+        return list(self._jobs.get(user_id, ()))
+
+    def submit(self, user_id: int, title: str, run: Callable[[Job], Awaitable],
+               on_finish: Callable[[Job], Awaitable] = None) -> Job:
+        """Постановка run(job) в очередь. Результат run попадает в job.result, после неё вызывается on_finish"""
+        if sum(job.active for job in self.jobs(user_id)) >= self.per_user:
+            raise JobRejected('Дождитесь окончания текущей задачи (/jobs) или отмените её (/cancel)')
+        job = Job(next(self._ids), user_id, title, run, on_finish)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobRejected('Сейчас слишком много задач, попробуйте позже')
+        self._jobs.setdefault(user_id, deque(maxlen=self.history)).append(job)
+        self._jobs.move_to_end(user_id)
+        while len(self._jobs) > self.max_users:
+            user_id, jobs = next(iter(self._jobs.items()))
+            if any(job.active for job in jobs):
+                break
+            del self._jobs[user_id]
+        logger.info(f'Job #{job.id} {title} queued for {job.user_id}')
+        return job
+
+    def cancel(self, user_id: int) -> list[Job]:
+        """Отмена активных задач пользователя. Шаг, уже запущенный в пуле процессов, доработает впустую"""
+        cancelled = []
+        for job in self.jobs(user_id):
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished_at = time.monotonic()
+            elif job.state == RUNNING:
+                job.task.cancel()
+            else:
+                continue
+            cancelled.append(job)
+        return cancelled
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            if job.state == CANCELLED:
+                continue
+            job.task = asyncio.create_task(self._run(job))
+            await asyncio.wait([job.task])
+
+    async def _run(self, job: Job):
+        job.state = RUNNING
+        job.started_at = time.monotonic()
+        try:
+            job.result = await job.run(job)
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+        except Exception as e:
+            logger.exception(f'Job #{job.id} {job.title} failed: {e}')
+            job.state = FAILED
+            job.error = e
+        else:
+            job.state = DONE
+        job.finished_at = time.monotonic()
+        job_seconds.observe(job.finished_at - job.started_at, state=job.state)
+        logger.info(f'Job #{job.id} {job.title} {job.state} in {job.finished_at - job.started_at:.1f}s')
+        if job.on_finish is not None:
+            try:
+                await job.on_finish(job)
+            except Exception as e:
+                logger.warning(f'Job #{job.id} on_finish failed: {e}')
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+        for jobs in self._jobs.values():
+            for job in jobs:
+                if job.task is not None and not job.task.done():
+                    job.task.cancel()
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
@@ -1,24 +1,33 @@
 # TODO: add tests and edit project structure
 
+from startup import Startup
+
 import os
 import random
 import re
 
 import db.db as db
+from db.storage import PostgresStorage, StorageFlushMiddleware, create_storage
+import exporter
+import importer
+import jobs
+import metrics
+import reviews
+import sender
+import translation
 
 import csv
+import tempfile
 
-from aiogram import Bot, Dispatcher, executor, types
+from aiogram import Dispatcher, executor, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text, Command
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
 from dotenv import load_dotenv
 from loguru import logger
 from models import *
-
-from googletrans import Translator
+from sessions import SessionStore
 
 
 class States(StatesGroup):
@@ -33,10 +42,9 @@ class States(StatesGroup):
     PROCESS_ANSWER = State()
 
 
-def create_correct_definition_question(lang: str = 'eng') -> Question:
+def create_correct_definition_question(words: list[tuple[str, str]], lang: str = 'eng') -> Question:
     """Создание вопроса для викторины Правильный перевод"""
-    words = db.select_n_random(4, lang)
-    correct_option_id = random.randrange(0, 4)
+    correct_option_id = random.randrange(len(words))
     telegram_line_length_limit_in_poll = 100
     options = [el[1][:telegram_line_length_limit_in_poll] for el in words]
     question_string = words[correct_option_id][0]
@@ -45,15 +53,15 @@ def create_correct_definition_question(lang: str = 'eng') -> Question:
         lang=lang,
         question=question_string,
         options=options,
-        correct_option_id=correct_option_id
+        correct_option_id=correct_option_id,
+        words=(question_string,)
     )
 
 
-def create_skipped_letters_question(lang: str = 'eng') -> Question:
+def create_skipped_letters_question(res: list[tuple[str, str]], lang: str = 'eng') -> Question:
     """Создание вопроса для викторины Пропуск букв"""
-    res = db.select_n_random(1, lang)[0]
-    word: str = res[0]
-    definition: str = res[1]
+    word: str = res[0][0]
+    definition: str = res[0][1]
     while True:
         k = random.randrange(len(word))
         if word[k] != ' ':
@@ -65,13 +73,13 @@ def create_skipped_letters_question(lang: str = 'eng') -> Question:
         type_='skipped',
         lang=lang,
         question=question_string,
-        options=options
+        options=options,
+        words=(word,)
     )
 
 
-def create_find_pairs_question(lang: str = 'eng') -> Question:
+def create_find_pairs_question(res: list[tuple[str, str]], lang: str = 'eng') -> Question:
     """Создание вопроса для викторины Найти пары"""
-    res = db.select_n_random(4, lang)
     words = [el[0] for el in res]
     definitions = [el[1] for el in res]
     random.shuffle(definitions)
@@ -84,25 +92,93 @@ def create_find_pairs_question(lang: str = 'eng') -> Question:
         type_='pairs',
         lang=lang,
         question=question_string,
-        options=options
+        options=options,
+        words=tuple(words)
+    )
+
+
+def create_review_question(res: list[tuple[str, str]], lang: str = 'eng') -> Question:
+    """Создание вопроса для режима Повторение: первое слово выборки - повторяемое, остальные - неверные варианты"""
+    telegram_line_length_limit_in_poll = 100
+    options = res[:]
+    random.shuffle(options)
+    return Question(
+        type_='quiz',
+        lang=lang,
+        question=res[0][0],
+        options=[el[1][:telegram_line_length_limit_in_poll] for el in options],
+        correct_option_id=options.index(res[0]),
+        words=(res[0][0],)
     )
 
 
 quizzes = {
     'Правильный перевод': create_correct_definition_question,
     'Пропуск букв': create_skipped_letters_question,
-    'Найти пары': create_find_pairs_question
+    'Найти пары': create_find_pairs_question,
+    'Повторение': create_review_question
 }
-question_count = 0
-correct_count = 0
-number_of_questions = 5
-question = Question()
+rows_per_question = {
+    'Правильный перевод': 4,
+    'Пропуск букв': 1,
+    'Найти пары': 4,
+    'Повторение': 4
+}
+
+
+async def create_review_session(user_id: int, number_of_questions: int, lang: str = 'eng',
+                                owner: int = 0) -> QuizSession:
+    """Сначала слова, которые пора повторить, затем случайные новые"""
+    terms = await db.select_terms(await review_scheduler.due(user_id, lang, number_of_questions, owner), lang, owner)
+    seen = {el[0] for el in terms}
+    for term in await db.select_n_random(number_of_questions, lang, distinct=True, owner=owner):
+        if len(terms) >= number_of_questions:
+            break
+        if term[0] not in seen:
+            seen.add(term[0])
+            terms.append(term)
+    questions = []
+    for term in terms:
+        wrong = [el for el in await db.select_n_random(rows_per_question['Повторение'], lang, distinct=True,
+                                                       owner=owner)
+                 if el[0] != term[0] and el[1] != term[1]]
+        questions.append(create_review_question([term, *wrong[:rows_per_question['Повторение'] - 1]], lang))
+    return QuizSession(questions, owner)
+
+
+async def create_quiz_session(quiz_type: str, number_of_questions: int, lang: str = 'eng',
+                              user_id: int = None, owner: int = 0) -> QuizSession:
+    """Все вопросы викторины строятся сразу по одной выборке из словаря owner"""
+    if quiz_type == 'Повторение':
+        return await create_review_session(user_id, number_of_questions, lang, owner)
+    size = rows_per_question[quiz_type]
+    rows = await db.select_n_random(number_of_questions * size, lang, distinct=True, owner=owner)
+    return QuizSession.build(quizzes[quiz_type], rows, number_of_questions, size, lang, owner)
+
 
 load_dotenv()
 API_TOKEN = os.getenv('DICT_API_TOKEN')
-storage = MemoryStorage()
-bot = Bot(token=API_TOKEN)
+storage = create_storage()
+sessions = SessionStore(ttl=float(os.getenv('QUIZ_SESSION_TTL', 3600)),
+                        max_sessions=int(os.getenv('QUIZ_MAX_SESSIONS', 10000)))
+quiz_max_questions = int(os.getenv('QUIZ_MAX_QUESTIONS', 50))
+bot = sender.ScheduledBot(token=API_TOKEN,
+                          sender=sender.Sender(rate=float(os.getenv('SEND_RATE', 30)),
+                                               chat_rate=float(os.getenv('SEND_CHAT_RATE', 1)),
+                                               chat_burst=float(os.getenv('SEND_CHAT_BURST', 5))))
+review_scheduler = reviews.ReviewScheduler(batch_size=int(os.getenv('REVIEW_BATCH_SIZE', 100)),
+                                           flush_interval=float(os.getenv('REVIEW_FLUSH_INTERVAL', 5)))
 dp = Dispatcher(bot, storage=storage)
+if isinstance(storage, PostgresStorage):
+    dp.middleware.setup(StorageFlushMiddleware(storage))
+job_runner = jobs.JobRunner(workers=int(os.getenv('JOBS_WORKERS', 2)),
+                            max_queue=int(os.getenv('JOBS_QUEUE_SIZE', 20)),
+                            per_user=int(os.getenv('JOBS_PER_USER', 1)),
+                            process_workers=int(os.getenv('JOBS_PROCESS_WORKERS', 0)) or None)
+startup = Startup(metrics.registry)
+dp.middleware.setup(metrics.FirstResponseMiddleware(startup.responded))
+dp.middleware.setup(metrics.HandlerMetricsMiddleware(slow_threshold=float(os.getenv('HANDLER_SLOW_MS', 1000)) / 1000))
+metrics_runner = None
 help_cmd = {
     'random_5': '5 случайных слов из словаря',
     'select': 'Получить перевод/определение слова из словаря',
@@ -114,8 +190,14 @@ help_cmd = {
 csv_description = 'Для добавление слов через отправку CSV файла, его необходимо назвать "язык.csv". ' \
                   'Например: eng.csv, ru.csv\nТакже слова в файле должны соответствовать шаблону: "слово, перевод" ' \
                   'Например: book, бронировать'
-langs = ['eng', 'ru']
-translator = Translator()
+export_description = 'Для выгрузки словаря: /export язык [csv|jsonl|text]. Например: /export eng csv'
+jobs_description = 'Импорт и выгрузка идут в фоне: статус - /jobs, отмена - /cancel'
+copy_description = 'У каждого чата свой словарь. Слова, добавленные до этого, лежат в общем словаре, ' \
+                   'скопировать их себе: /copy язык. Например: /copy eng'
+empty_description = 'Словарь пуст :(\n' + copy_description
+prep_terms_offload_rows = int(os.getenv('PREP_TERMS_OFFLOAD_ROWS', 1000))
+translator = translation.create_translator()
+translation_dest = os.getenv('TRANSLATION_DEST', 'ru')
 
 
 def create_keyboard(legends: list) -> types.ReplyKeyboardMarkup:
@@ -128,6 +210,12 @@ def create_keyboard(legends: list) -> types.ReplyKeyboardMarkup:
 keyboard = create_keyboard(list(help_cmd.values()))
 
 
+def format_term(word: str, defi: list[str]) -> str:
+    if len(defi) > 1:
+        return word.upper() + ' - ' + '. '.join([f'{i + 1}. {defi[i]}' for i in range(len(defi))])
+    return word.upper() + ' - ' + defi[0]
+
+
 def prep_terms(terms: list) -> str:
     d = dict()
     for el in terms:
@@ -135,16 +223,37 @@ def prep_terms(terms: list) -> str:
             d[el[0]] = [el[1]]
         else:
             d[el[0]].append(el[1])
-    return "\n".join(
-        [word.upper() + ' - ' + '. '.join([f'{i + 1}. {defi[i]}' for i in range(len(defi))]) if len(
-            defi) > 1 else word.upper() + ' - ' + defi[0] for word, defi in
-         d.items()])
+    return "\n".join([format_term(word, defi) for word, defi in d.items()])
+
+
+async def render_terms(terms: list) -> str:
+    """Большие выборки форматируются в пуле процессов, чтобы не занимать event loop"""
+    if len(terms) > prep_terms_offload_rows:
+        return await job_runner.cpu(prep_terms, terms)
+    return prep_terms(terms)
+
+
+async def submit_job(message: types.Message, title: str, run) -> jobs.Job | None:
+    """Задача в фоне. Итоговый текст (результат run) или ошибка отправляются в чат"""
+    async def finish(job: jobs.Job):
+        if job.state == jobs.DONE and job.result:
+            await message.answer(job.result, reply_markup=keyboard)
+        elif job.state == jobs.FAILED:
+            await message.answer(f'Задача #{job.id} {job.title} завершилась с ошибкой', reply_markup=keyboard)
+
+    try:
+        job = job_runner.submit(message.from_user.id, title, run, on_finish=finish)
+    except jobs.JobRejected as e:
+        await message.answer(str(e), reply_markup=keyboard)
+        return None
+    await message.answer(f'Задача #{job.id} {title} поставлена в очередь. {jobs_description}')
+    return job
 
 
 async def check_correct_lang(lang: str, message: types.Message) -> bool:
-    if lang not in langs:
-        await message.answer('Такого языка не существует. Выберите из: ' + ', '.join(langs),
-                             reply_markup=create_keyboard(langs))
+    if lang not in db.languages:
+        await message.answer('Такого языка не существует. Выберите из: ' + ', '.join(db.languages),
+                             reply_markup=create_keyboard(db.languages))
         await States.INPUT_LANG.set()
         return False
     return True
@@ -157,20 +266,80 @@ async def description(message: types.message):
     legend in help_cmd.items()])
     await message.answer(s, reply_markup=keyboard)
     await message.answer(csv_description)
+    await message.answer(export_description)
+    await message.answer(jobs_description)
+    await message.answer(copy_description)
 
 
 @dp.message_handler(state='*', commands='cancel')
 @dp.message_handler(Text(equals='cancel', ignore_case=True), state='*')
 async def cancel(message: types.message, state: FSMContext):
+    cancelled = job_runner.cancel(message.from_user.id)
     current_state = await state.get_state()
-    if current_state is None:
+    if current_state is None and not cancelled:
         return
 
-    logger.info(f'Canceling state {current_state}')
+    logger.info(f'Canceling state {current_state}, jobs {[job.id for job in cancelled]}')
+    sessions.pop(message.from_user.id)
     await state.finish()
     await message.reply('Cancelled.', reply_markup=keyboard)
 
 
+@dp.message_handler(commands='jobs', state='*')
+async def show_jobs(message: types.Message):
+    user_jobs = job_runner.jobs(message.from_user.id)
+    if not user_jobs:
+        await message.answer('Задач нет')
+        return
+    await message.answer('\n'.join(str(job) for job in reversed(user_jobs)))
+
+
+@dp.message_handler(commands='copy')
+async def copy_shared(message: types.Message):
+    args = message.get_args().split()
+    if len(args) != 1 or args[0] not in db.languages:
+        await message.answer(copy_description)
+        return
+    lang = args[0]
+    owner = message.chat.id
+
+    async def run(job: jobs.Job) -> str:
+        count = await db.copy_dictionary(lang, owner)
+        return f'Скопировано определений: {count}' if count else 'Нечего копировать: общий словарь пуст или уже скопирован'
+
+    await submit_job(message, f'Копирование общего словаря {lang}', run)
+
+
+@dp.message_handler(commands='export')
+async def export(message: types.Message):
+    args = message.get_args().split()
+    if not args or args[0] not in db.languages or len(args) > 1 and args[1] not in exporter.FORMATS:
+        await message.answer(export_description)
+        return
+    lang = args[0]
+    format_ = args[1] if len(args) > 1 else 'csv'
+    owner = message.chat.id
+
+    async def run(job: jobs.Job) -> str | None:
+        if format_ == 'text':
+            pages = 0
+            with sender.bulk():
+                async for page in exporter.iter_pages(lang, format_term, owner=owner):
+                    await message.answer(page)
+                    pages += 1
+                    job.progress = f'Отправлено сообщений: {pages}'
+            return None if pages else empty_description
+        with tempfile.TemporaryFile() as file:
+            count = await exporter.write_file(lang, file, format_, run_io=job_runner.io, owner=owner)
+            if not count:
+                return empty_description
+            file.seek(0)
+            await message.answer_document(types.InputFile(file, filename=f'{lang}.{format_}'),
+                                          caption=f'Слов: {count}')
+
+    await submit_job(message, f'Выгрузка {lang}.{format_}', run)
+
+
 @dp.message_handler(Text(equals=help_cmd.values(), ignore_case=True) |
                     Command(commands=help_cmd.keys(), ignore_case=True))
 async def process_command(message: types.Message, state: FSMContext):
@@ -194,42 +363,43 @@ async def process_command(message: types.Message, state: FSMContext):
         else:
             await description(message)
     else:
-        await message.answer('Выберите язык:', reply_markup=create_keyboard(langs))
+        await message.answer('Выберите язык:', reply_markup=create_keyboard(db.languages))
         await States.INPUT_LANG.set()
 
 
 @dp.message_handler(state=States.INPUT_LANG)
 async def process_lang(message: types.Message, state: FSMContext):
     lang = message.text
+    owner = message.chat.id
     if not await check_correct_lang(lang, message):
         return
     await state.update_data(lang=lang)
     data = await state.get_data()
     command = data.get('command')
     if re.match(r'^\/select_\d+', command) or command == help_cmd['select_5']:
-        words = db.select_last_n_terms(
-            int(re.search(r'\d+', command).group()), lang)
+        words = await db.select_last_n_terms(
+            int(re.search(r'\d+', command).group()), lang, owner)
     elif re.match(r'^\/random_\d+', command) or command == help_cmd['random_5']:
-        words = db.select_n_random(
-            int(re.search(r'\d+', command).group()), lang)
+        words = await db.select_n_random(
+            int(re.search(r'\d+', command).group()), lang, owner=owner)
     elif command in ['/select', '/add', '/delete', help_cmd['select'], help_cmd['add'], help_cmd['delete']]:
-        last_5_words = db.select_last_n_terms(5, lang)
+        last_5_words = await db.select_last_n_terms(5, lang, owner)
         await message.answer("Введите слово", reply_markup=create_keyboard([el[0] for el in last_5_words]))
         await state.update_data(lang=lang)
         await States.INPUT_WORD.set()
         return
     else:  # quizzes
-        if db.select_n_random(1, lang):
+        if await db.select_n_random(1, lang, owner=owner):
             await message.answer('Выберите викторину', reply_markup=create_keyboard(quizzes))
             await States.CHOOSE_QUIZ.set()
         else:
-            await message.answer("Словарь пуст :(", reply_markup=keyboard)
+            await message.answer(empty_description, reply_markup=keyboard)
             await state.finish()
         return
     if words:
-        s = prep_terms(words)
+        s = await render_terms(words)
     else:
-        s = "Словарь пуст :("
+        s = empty_description
     await message.answer(s, reply_markup=keyboard)
     await state.finish()
 
@@ -239,24 +409,33 @@ async def process_word(message: types.message, state: FSMContext):
     data = await state.get_data()
     word = data.get('word') or message.text.lower()
     lang = data.get('lang')
+    owner = message.chat.id
     command = data.get('command')
-    terms = db.select_all_definitions(word, lang)
-    s = prep_terms(terms) if terms else None
+    terms = await db.select_all_definitions(word, lang, owner)
+    s = await render_terms(terms) if terms else None
     if command in ['/select', help_cmd['select']]:
         if not s:
-            await message.answer('Такого слова нет в словаре. Хотите добавить определение?',
-                                 reply_markup=create_keyboard(['Да', 'Нет']))
+            candidates = await db.search_similar(word, lang, owner=owner)
+            if candidates:
+                await message.answer('Такого слова нет в словаре. Возможно, вы имели в виду: ' +
+                                     ', '.join(candidates) + '?\nИли хотите добавить определение?',
+                                     reply_markup=create_keyboard(candidates + ['Да', 'Нет']))
+            else:
+                await message.answer('Такого слова нет в словаре. Хотите добавить определение?',
+                                     reply_markup=create_keyboard(['Да', 'Нет']))
             await state.update_data(word=word)
             await States.CHOOSE_OPTION.set()
         else:
             await message.answer(s, reply_markup=keyboard)
             await state.finish()
     elif command in ['/delete', help_cmd['delete']]:
-        db.delete(word, lang)
-        await message.answer('Слово успешно удалено', reply_markup=keyboard)
+        if await db.delete(word, lang, owner):
+            await message.answer('Слово успешно удалено', reply_markup=keyboard)
+        else:
+            await message.answer('Такого слова нет в словаре', reply_markup=keyboard)
         await state.finish()
     else:  # /add
-        last_5_words = db.select_last_n_terms(5, lang)
+        last_5_words = await db.select_last_n_terms(5, lang, owner)
         if s:
             await message.answer(s)
         await message.answer("Введите перевод/определение:",
@@ -277,17 +456,22 @@ async def process_yes_or_no(message: types.Message, state: FSMContext):
         await state.finish()
 
 
+@dp.message_handler(state=States.CHOOSE_OPTION)
+async def process_suggestion(message: types.Message, state: FSMContext):
+    """Выбор одного из предложенных похожих слов"""
+    await state.update_data(word=message.text.lower())
+    await States.INPUT_WORD.set()
+    await process_word(message, state)
+
+
 @dp.message_handler(state=States.INPUT_DEFINITION)
 async def process_definition(message: types.Message, state: FSMContext):
     data = await state.get_data()
     lang = data.get('lang')
     word = data.get('word')
     definition = data.get('definition') or message.text
-    if '|' in definition:
-        for el in definition.split('|'):
-            db.insert(word=word.lower(), definition=el, lang=lang)
-    else:
-        db.insert(word=word.lower(), definition=definition, lang=lang)
+    definitions = [el.strip() for el in definition.split('|') if el.strip()]
+    await db.insert_definitions(word=word.lower(), definitions=definitions, lang=lang, owner=message.chat.id)
     await state.finish()
     await message.reply("Добавлено\n" + f'{word.upper()} - {definition}', reply_markup=keyboard)
 
@@ -297,27 +481,37 @@ async def get_csv(message: types.Message):
     document = message.document
     file_name = document.file_name
     lang = file_name.split('.csv')[0]
-    if lang not in langs:
+    if lang not in db.languages:
         await description(message)
         return
     file_id = document.file_id
+    owner = message.chat.id
     logger.info(f'Получен документ {file_name}')
-    if message.document.mime_type == 'text/csv':
+    if message.document.mime_type != 'text/csv':
+        await message.answer('Бот принимает только файлы формата CSV', reply_markup=keyboard)
+        return
+
+    async def run(job: jobs.Job) -> str:
         file = await bot.get_file(file_id)
-        file_path = file.file_path
-        await bot.download_file(file_path, file_name)
-        with open(file_name, 'r', encoding='utf-8') as file:
-            csv_file = csv.reader(file, delimiter=',')
-            for row in csv_file:
-                word = row[0].lower()
-                if len(row) == 1:
-                    db.insert(word, translator.translate(word, dest='ru'), lang)
-                elif len(row) == 2:
-                    db.insert(word, row[1], lang)
-        s = 'Слова успешно добавлены'
-    else:
-        s = 'Бот принимает только файлы формата CSV'
-    await message.answer(s, reply_markup=keyboard)
+        buffer = await bot.download_file(file.file_path)
+        status = await message.answer('Импорт начат')
+
+        async def report(stats: importer.ImportStats):
+            job.progress = str(stats)
+            with sender.bulk():
+                await status.edit_text(job.progress)
+
+        try:
+            parsed = await job_runner.cpu(importer.parse_csv, buffer.getvalue())
+        except (UnicodeDecodeError, csv.Error) as e:
+            logger.info(f'Не удалось разобрать {file_name}: {e}')
+            return 'Не удалось прочитать файл. ' + csv_description
+        stats = await importer.import_parsed(parsed, lang,
+                                             lambda words: translator.translate(words, lang, translation_dest),
+                                             progress=report, owner=owner)
+        return 'Слова успешно добавлены\n' + str(stats)
+
+    await submit_job(message, f'Импорт {file_name}', run)
 
 
 @dp.message_handler(Text(equals=quizzes), state=States.CHOOSE_QUIZ)
@@ -330,14 +524,22 @@ async def process_quiz_type(message: types.Message, state: FSMContext):
 
 @dp.message_handler(regexp=r'\d+', state=States.CHOOSE_NUMBER_OF_QUESTIONS)
 async def process_number_of_questions(message: types.Message, state: FSMContext):
-    global number_of_questions, question
-    number_of_questions = int(message.text)
-    print(number_of_questions)
+    number_of_questions = int(re.search(r'\d+', message.text).group())
+    if not 0 < number_of_questions <= quiz_max_questions:
+        await message.answer(f'Введите число от 1 до {quiz_max_questions}')
+        return
     data = await state.get_data()
     lang = data.get('lang')
     quiz_type = data.get('quiz_type')
-    question = quizzes[quiz_type](lang)
-    if quiz_type == 'Правильный перевод':
+    session = await create_quiz_session(quiz_type, number_of_questions, lang, message.from_user.id,
+                                        message.chat.id)
+    if session.finished:
+        await message.answer('В словаре нет слов для викторины', reply_markup=keyboard)
+        await state.finish()
+        return
+    sessions.set(message.from_user.id, session)
+    question = session.question
+    if question.type_ == 'quiz':
         await state.finish()
         await message.answer_poll(
             question='1. ' + question.question,
@@ -354,56 +556,102 @@ async def process_number_of_questions(message: types.Message, state: FSMContext)
 
 @dp.poll_answer_handler()
 async def handle_poll_answer(poll_answer: types.PollAnswer):
-    global question_count, correct_count, question
-    question_count += 1
-    if poll_answer.option_ids[0] == question.correct_option_id:
-        correct_count += 1
+    session = sessions.get(poll_answer.user.id)
+    if session is None:
+        return
+    question = session.question
+    correct = poll_answer.option_ids[0] == question.correct_option_id
+    session.answer(correct)
+    await review_scheduler.record(poll_answer.user.id, question.lang, question.words, correct, session.owner)
     await bot.send_message(poll_answer.user.id, question.question.upper() + ' - ' +
                            question.options[question.correct_option_id])
-    if question_count != number_of_questions:
-        question = create_correct_definition_question(question.lang)
+    if not session.finished:
+        question = session.question
         await bot.send_poll(
             chat_id=poll_answer.user.id,
-            question=f'{question_count + 1}. ' + question.question,
+            question=f'{session.question_count + 1}. ' + question.question,
             options=question.options,
             type=question.type_,
             correct_option_id=question.correct_option_id,
             is_anonymous=False
         )
     else:
-        await bot.send_message(poll_answer.user.id, f'Тестирование завершено. {correct_count}/{question_count}',
+        await bot.send_message(poll_answer.user.id,
+                               f'Тестирование завершено. {session.correct_count}/{session.question_count}',
                                reply_markup=keyboard)
-        question_count = 0
-        correct_count = 0
+        sessions.pop(poll_answer.user.id)
 
 
 @dp.message_handler(state=States.PROCESS_ANSWER)
 async def process_answer(message: types.Message, state: FSMContext):
-    global correct_count, question_count, question
-    question_count += 1
+    session = sessions.get(message.from_user.id)
+    if session is None:
+        await message.answer('Викторина устарела, начните заново', reply_markup=keyboard)
+        await state.finish()
+        return
+    question = session.question
     answer = message.text.lower()
+    correct = False
     if question.type_ == 'skipped':
-        if answer == question.options:
+        correct = answer == question.options
+        if correct:
             await message.answer('+1')
-            correct_count += 1
         else:
             await message.answer(f':( ответ: {question.options}')
     elif question.type_ == 'pairs':
-        if answer.split() == question.options:
+        correct = answer.split() == question.options
+        if correct:
             await message.answer('+1')
-            correct_count += 1
         else:
             await message.answer(f':( ответ: {" ".join(question.options)}')
-    if question_count == number_of_questions:
-        await message.answer(f'Тестирование завершено. {correct_count}/{question_count}', reply_markup=keyboard)
-        correct_count = 0
-        question_count = 0
+    session.answer(correct)
+    await review_scheduler.record(message.from_user.id, question.lang, question.words, correct, session.owner)
+    if session.finished:
+        await message.answer(f'Тестирование завершено. {session.correct_count}/{session.question_count}',
+                             reply_markup=keyboard)
+        sessions.pop(message.from_user.id)
         await state.finish()
     else:
-        question = quizzes[(await state.get_data())['quiz_type']](question.lang)
-        await message.answer(question.question, reply_markup=types.ReplyKeyboardRemove())
+        await message.answer(session.question.question, reply_markup=types.ReplyKeyboardRemove())
+
+
+async def on_startup(dispatcher: Dispatcher):
+    """Пул, схема и прогрев кэша до начала приёма апдейтов"""
+    global metrics_runner
+    startup.imported()
+    async with startup.stage('jobs'):
+        await job_runner.start()
+    if int(os.getenv('METRICS_PORT', 0)):
+        metrics_runner = await metrics.start_server(os.getenv('METRICS_HOST', '0.0.0.0'),
+                                                    int(os.getenv('METRICS_PORT')),
+                                                    ready=lambda: startup.ready)
+    async with startup.stage('pool'):
+        await db.init_pool()
+    async with startup.stage('migrations'):
+        await db.init_db()
+        await db.load_languages()
+    async with startup.stage('warm_up'):
+        await db.preload(int(os.getenv('WARM_UP_DICTIONARIES', 100)))
+    if isinstance(storage, PostgresStorage):
+        storage.start()
+    review_scheduler.start()
+    startup.set_ready()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await job_runner.close()
+    await bot.sender.close()
+    await storage.close()
+    await review_scheduler.close()
+    await db.close_pool()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
 
 
 if __name__ == '__main__':
-    db.select_n_random(1, 'eng')
-    executor.start_polling(dp, skip_updates=True)
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        import ingress
+
+        ingress.start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,194 @@
+import bisect
+import time
+from typing import Callable
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(labels.get(el, '') for el in self.labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in self.values.items())
+        return lines
+
+
+class Gauge:
+    """Значение читается в момент запроса метрик"""
+
+    def __init__(self, name: str, description: str, collect: Callable[[], dict[tuple, float]],
+                 labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.collect: Callable[[], dict[tuple, float]] = collect
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+        lines.extend(f'{self.name}{_format_labels(self.labels, key)} {value}'
+                     for key, value in self.collect().items())
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.description: str = description
+        self.labels: tuple[str, ...] = labels
+        self.buckets: tuple[float, ...] = buckets
+        self.values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(el, '') for el in self.labels)
+        counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total[0]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name: str, description: str, collect: Callable[[], dict[tuple, float]],
+              labels: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, description, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.debug(f'Failed to collect {metric.name}: {e}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+query_seconds = registry.histogram('dict_db_query_seconds', 'Database call latency', ('function',))
+query_rows = registry.histogram('dict_db_query_rows', 'Rows returned by database calls', ('function',), ROWS_BUCKETS)
+slow_queries = registry.counter('dict_db_slow_queries_total', 'Database calls slower than the threshold',
+                                ('function',))
+handler_seconds = registry.histogram('dict_handler_seconds', 'Update handler latency', ('handler',))
+
+
+def truncate(results, limit: int = 5) -> str:
+    """Короткое представление результата запроса для логов"""
+    if isinstance(results, list) and len(results) > limit:
+        return f'{results[:limit]} ... ({len(results)} rows)'
+    return str(results)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы каждого обработчика aiogram с меткой по имени функции"""
+
+    def __init__(self, slow_threshold: float = 1.0):
+        super().__init__()
+        self.slow_threshold: float = slow_threshold
+
+    @staticmethod
+    def _start(data: dict):
+        handler = current_handler.get()
+        data['_metrics_handler'] = getattr(handler, '__name__', str(handler))
+        data['_metrics_started_at'] = time.perf_counter()
+
+    def _finish(self, data: dict):
+        if '_metrics_started_at' not in data:
+            return
+        handler = data.pop('_metrics_handler')
+        elapsed = time.perf_counter() - data.pop('_metrics_started_at')
+        handler_seconds.observe(elapsed, handler=handler)
+        if elapsed > self.slow_threshold:
+            logger.warning(f'Slow handler {handler}: {elapsed * 1000:.0f} ms')
+
+    async def on_process_message(self, message, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        self._finish(data)
+
+    async def on_process_poll_answer(self, poll_answer, data: dict):
+        self._start(data)
+
+    async def on_post_process_poll_answer(self, poll_answer, results, data: dict):
+        self._finish(data)
+
+
+class FirstResponseMiddleware(BaseMiddleware):
+    """Вызывает on_first_response после обработки первого апдейта"""
+
+    def __init__(self, on_first_response: Callable[[], None]):
+        super().__init__()
+        self.on_first_response: Callable[[], None] | None = on_first_response
+
+    async def on_post_process_update(self, update, results, data: dict):
+        if self.on_first_response is not None:
+            on_first_response, self.on_first_response = self.on_first_response, None
+            on_first_response()
+
+
+async def start_server(host: str, port: int, ready: Callable[[], bool] = None) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def handle_ready(request: web.Request) -> web.Response:
+        if ready is None or ready():
+            return web.Response(text='ready')
+        return web.Response(status=503, text='starting')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    app.router.add_get('/ready', handle_ready)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f'Metrics are served on http://{host}:{port}/metrics')
+    return runner
@@ -1,13 +1,65 @@
+import random
+
+
 class Question:
+    __slots__ = ('type_', 'lang', 'question', 'options', 'correct_option_id', 'words')
 
     def __init__(self,
                  type_: str = 'quiz',
                  question: str = '',
                  options: list[str] | str = '',
                  correct_option_id: int = None,
-                 lang: str = 'eng'):
+                 lang: str = 'eng',
+                 words: tuple[str, ...] = ()):
         self.type_: str = type_
         self.lang: str = lang
         self.question: str = question
         self.options: list[str] | str = options
         self.correct_option_id: int = correct_option_id
+        self.words: tuple[str, ...] = words
+
+
+class QuizSession:
+    __slots__ = ('questions', 'question_count', 'correct_count', 'owner')
+
+    def __init__(self, questions: list[Question] = None, owner: int = 0):
+        self.questions: list[Question] = questions or []
+        self.owner: int = owner
+        self.question_count: int = 0
+        self.correct_count: int = 0
+
+    @property
+    def number_of_questions(self) -> int:
+        return len(self.questions)
+
+    @property
+    def question(self) -> Question:
+        return self.questions[self.question_count]
+
+    @property
+    def finished(self) -> bool:
+        return self.question_count >= self.number_of_questions
+
+    def answer(self, correct: bool):
+        self.question_count += 1
+        self.correct_count += correct
+
+    @classmethod
+    def build(cls,
+              create_question,
+              rows: list[tuple[str, str]],
+              number_of_questions: int,
+              rows_per_question: int,
+              lang: str = 'eng',
+              owner: int = 0) -> 'QuizSession':
+        """Раскладывает выборку по вопросам. Слова повторяются, только если словарь меньше викторины"""
+        questions = []
+        pool = rows[:]
+        i = 0
+        while len(questions) < number_of_questions and rows:
+            if i + rows_per_question > len(pool) and i:
+                random.shuffle(pool)
+                i = 0
+            questions.append(create_question(pool[i:i + rows_per_question], lang))
+            i += rows_per_question
+        return cls(questions, owner)
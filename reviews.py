@@ -0,0 +1,156 @@
+"""Интервальное повторение слов по алгоритму SM-2.
+
+Ответы в викторинах копятся в памяти и записываются в таблицу reviews пачками.
+Слова к повторению берутся по индексу (user_id, due_at) в небольшую кучу на пользователя,
+из которой следующее слово достаётся за O(log n).
+"""
+import asyncio
+import heapq
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+import db.db as db
+import metrics
+
+CORRECT_QUALITY = 4
+WRONG_QUALITY = 1
+DAY = 24 * 3600
+
+
+class Review:
+    __slots__ = ('repetitions', 'interval', 'ease')
+
+    def __init__(self, repetitions: int = 0, interval: float = 0.0, ease: float = 2.5):
+        self.repetitions: int = repetitions
+        self.interval: float = interval
+        self.ease: float = ease
+
+    def answer(self, quality: int) -> float:
+        """Оценка ответа от 0 до 5. Возвращает интервал до следующего повторения в днях"""
+        if quality >= 3:
+            if self.repetitions == 0:
+                self.interval = 1
+            elif self.repetitions == 1:
+                self.interval = 6
+            else:
+                self.interval = round(self.interval * self.ease)
+            self.repetitions += 1
+        else:
+            self.repetitions = 0
+            self.interval = 1
+        self.ease = max(1.3, self.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        return self.interval
+
+
+class DueQueue:
+    """Куча (due_at, word_id) с ленивым удалением"""
+    __slots__ = ('_heap', '_due')
+
+    def __init__(self):
+        self._heap: list[tuple[float, int]] = []
+        self._due: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def push(self, word_id: int, due_at: float):
+        self._due[word_id] = due_at
+        heapq.heappush(self._heap, (due_at, word_id))
+
+    def discard(self, word_id: int):
+        self._due.pop(word_id, None)
+
+    def pop(self) -> int | None:
+        while self._heap:
+            due_at, word_id = heapq.heappop(self._heap)
+            if self._due.get(word_id) == due_at:
+                del self._due[word_id]
+                return word_id
+        return None
+
+
+class ReviewScheduler:
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5, queue_size: int = 50,
+                 max_queues: int = 10000):
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.queue_size: int = queue_size
+        self.max_queues: int = max_queues
+        self._pending: list[tuple[int, int, int, float]] = []
+        self._queues: OrderedDict[tuple[int, int, str], DueQueue] = OrderedDict()
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._flushing: asyncio.Task | None = None
+        metrics.registry.gauge('dict_reviews_pending', 'Quiz answers waiting to be written',
+                               lambda: {(): len(self._pending)})
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f'Writing reviews failed: {e}')
+
+    async def record(self, user_id: int, lang: str, words: tuple[str, ...], correct: bool, owner: int = 0):
+        """Ответ пользователя по словам вопроса из словаря owner. Запись в БД произойдёт со следующей пачкой"""
+        quality = CORRECT_QUALITY if correct else WRONG_QUALITY
+        answered_at = time.time()
+        queue = self._queues.get((user_id, owner, lang))
+        for word_id in await db.select_word_ids(list(words), lang, owner):
+            self._pending.append((user_id, word_id, quality, answered_at))
+            if queue is not None:
+                queue.discard(word_id)
+        if len(self._pending) >= self.batch_size and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                keys = list({(user_id, word_id) for user_id, word_id, _, _ in pending})
+                reviews = {(user_id, word_id): Review(repetitions, interval, ease)
+                           for user_id, word_id, repetitions, interval, ease in await db.select_reviews(keys)}
+                rows = {}
+                for user_id, word_id, quality, answered_at in pending:
+                    review = reviews.setdefault((user_id, word_id), Review())
+                    due_at = answered_at + review.answer(quality) * DAY
+                    rows[(user_id, word_id)] = (user_id, word_id, review.repetitions, review.interval, review.ease,
+                                                due_at, answered_at)
+                await db.upsert_reviews(list(rows.values()))
+            except Exception:
+                self._pending[:0] = pending
+                raise
+            logger.debug(f'Written {len(rows)} reviews for {len(pending)} answers')
+
+    async def due(self, user_id: int, lang: str, n: int, owner: int = 0) -> list[int]:
+        """До n слов словаря owner, которые пора повторить, самые просроченные первыми"""
+        key = (user_id, owner, lang)
+        queue = self._queues.get(key)
+        if queue is None or len(queue) < n:
+            await self.flush()
+            queue = self._queues[key] = DueQueue()
+            for word_id, due_at in await db.select_due_reviews(user_id, lang, max(n, self.queue_size), owner):
+                queue.push(word_id, due_at)
+            while len(self._queues) > self.max_queues:
+                self._queues.popitem(last=False)
+        self._queues.move_to_end(key)
+        result = []
+        while len(result) < n and (word_id := queue.pop()) is not None:
+            result.append(word_id)
+        return result
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
@@ -0,0 +1,207 @@
+"""Очередь исходящих запросов к Telegram с ограничением частоты.
+
+Все send*/edit*-методы ScheduledBot проходят через Sender: общий token bucket на бота,
+отдельный на каждый чат, повтор после RetryAfter. Ответы пользователю идут раньше
+массовых уведомлений (импорт, экспорт), которые отправляются внутри `with sender.bulk()`.
+"""
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+from loguru import logger
+
+import metrics
+
+INTERACTIVE = 0
+BULK = 1
+SCHEDULED_METHOD_PREFIXES = ('send', 'edit', 'copyMessage', 'forwardMessage')
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+send_seconds = metrics.registry.histogram('dict_send_seconds', 'Time from enqueue to Telegram response',
+                                          ('priority',))
+send_retries = metrics.registry.counter('dict_send_retries_total', 'Sends retried after flood control')
+
+
+@contextlib.contextmanager
+def bulk():
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated_at: float = time.monotonic()
+        self.blocked_until: float = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available_at(self, now: float) -> float:
+        self._refill(now)
+        ready_at = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready_at, self.blocked_until)
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Item:
+    __slots__ = ('chat_id', 'priority', 'call', 'retry', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id, priority: int, call, retry: bool, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority: int = priority
+        self.call = call
+        self.retry: bool = retry
+        self.future: asyncio.Future = future
+        self.enqueued_at: float = time.monotonic()
+        self.attempts: int = 0
+
+
+class Sender:
+
+    def __init__(self, rate: float = 30, chat_rate: float = 1, chat_burst: float = 5,
+                 max_in_flight: int = 30, max_retries: int = 5, max_chats: int = 10000):
+        self.chat_rate: float = chat_rate
+        self.chat_burst: float = chat_burst
+        self.max_retries: int = max_retries
+        self.max_chats: int = max_chats
+        self._bucket: TokenBucket = TokenBucket(rate, rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._queues: tuple[deque, deque] = (deque(), deque())
+        self._in_flight: asyncio.Semaphore = asyncio.Semaphore(max_in_flight)
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        metrics.registry.gauge('dict_send_queue_depth', 'Messages waiting to be sent',
+                               lambda: {('interactive',): len(self._queues[INTERACTIVE]),
+                                        ('bulk',): len(self._queues[BULK])}, ('priority',))
+
+    @property
+    def depth(self) -> int:
+        return sum(len(el) for el in self._queues)
+
+    async def submit(self, chat_id, call, priority: int | None = None, retry: bool = True):
+        """Постановка call() в очередь. Возвращает результат запроса, когда он будет отправлен.
+
+        retry=False — не повторять после RetryAfter (например, файлы уже прочитаны первой попыткой)
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        item = _Item(chat_id, _priority.get() if priority is None else priority,
+                     call, retry, asyncio.get_running_loop().create_future())
+        self._queues[item.priority].append(item)
+        self._wakeup.set()
+        return await item.future
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                now = time.monotonic()
+                for key in [key for key, el in self._chats.items() if el.idle(now)]:
+                    del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pick(self) -> tuple[_Item | None, float]:
+        """Первый элемент, который можно отправить сейчас, или время до ближайшей возможности"""
+        now = time.monotonic()
+        ready_at = self._bucket.available_at(now)
+        if ready_at > now:
+            return None, ready_at - now
+        wait = None
+        for queue in self._queues:
+            for item in [el for el in queue if el.future.cancelled()]:
+                queue.remove(item)
+            for item in queue:
+                chat_ready_at = self._chat_bucket(item.chat_id).available_at(now)
+                if chat_ready_at <= now:
+                    queue.remove(item)
+                    return item, 0
+                wait = chat_ready_at - now if wait is None else min(wait, chat_ready_at - now)
+        return None, wait
+
+    async def _loop(self):
+        while True:
+            item, wait = self._pick()
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._in_flight.acquire()
+            self._bucket.take()
+            self._chat_bucket(item.chat_id).take()
+            asyncio.create_task(self._send(item))
+
+    async def _send(self, item: _Item):
+        try:
+            item.attempts += 1
+            result = await item.call()
+        except RetryAfter as e:
+            self._chat_bucket(item.chat_id).blocked_until = time.monotonic() + e.timeout
+            if item.future.done():
+                return
+            if not item.retry or item.attempts > self.max_retries:
+                item.future.set_exception(e)
+                return
+            logger.warning(f'Flood control for chat {item.chat_id}, retry in {e.timeout}s')
+            send_retries.inc()
+            self._queues[item.priority].appendleft(item)
+            self._wakeup.set()
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            send_seconds.observe(time.monotonic() - item.enqueued_at,
+                                 priority='interactive' if item.priority == INTERACTIVE else 'bulk')
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._in_flight.release()
+
+    async def close(self, timeout: float = 10):
+        """Ждёт отправки очереди не дольше timeout и останавливает цикл"""
+        deadline = time.monotonic() + timeout
+        while self.depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class ScheduledBot(Bot):
+    """Bot, у которого отправка сообщений идёт через Sender"""
+
+    def __init__(self, token: str, sender: Sender, **kwargs):
+        super().__init__(token, **kwargs)
+        self.sender: Sender = sender
+        self.send_request = super().request
+
+    async def request(self, method: str, data=None, files=None, **kwargs):
+        if not method.startswith(SCHEDULED_METHOD_PREFIXES) or not data or 'chat_id' not in data:
+            return await self.send_request(method, data, files, **kwargs)
+        # файлы — потоки, прочитанные первой попыткой: повтор отправил бы их пустыми
+        return await self.sender.submit(data['chat_id'],
+                                        lambda: self.send_request(method, data, files, **kwargs),
+                                        retry=not files)
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+from models import QuizSession
+
+
+class SessionStore:
+    """Викторины пользователей с истечением по TTL и ограничением количества"""
+
+    def __init__(self, ttl: float = 3600, max_sessions: int = 10000):
+        self.ttl: float = ttl
+        self.max_sessions: int = max_sessions
+        self._sessions: OrderedDict[int, tuple[float, QuizSession]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int) -> QuizSession | None:
+        self.sweep()
+        item = self._sessions.get(user_id)
+        if item is None:
+            return None
+        self._sessions[user_id] = (time.monotonic(), item[1])
+        self._sessions.move_to_end(user_id)
+        return item[1]
+
+    def set(self, user_id: int, session: QuizSession):
+        self._sessions[user_id] = (time.monotonic(), session)
+        self._sessions.move_to_end(user_id)
+        self.sweep()
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def pop(self, user_id: int) -> QuizSession | None:
+        item = self._sessions.pop(user_id, None)
+        return item[1] if item else None
+
+    def sweep(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            touched_at, _ = next(iter(self._sessions.values()))
+            if touched_at > deadline:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,49 @@
+"""Этапы запуска бота, сигнал готовности и время до первого ответа.
+
+Модуль импортируется в main.py первым, время отсчитывается от его импорта.
+Пока бот не готов, GET /ready на сервере метрик отвечает 503.
+"""
+import contextlib
+import time
+
+from loguru import logger
+
+started_at = time.monotonic()
+
+
+class Startup:
+
+    def __init__(self, registry: 'metrics.Registry'):
+        self.stages: dict[str, float] = {}
+        self.ready: bool = False
+        self.ready_at: float | None = None
+        self.first_response_at: float | None = None
+        registry.gauge('dict_startup_seconds', 'Startup stage durations and time to first response',
+                       lambda: {(k,): v for k, v in self.stages.items()}, ('stage',))
+        registry.gauge('dict_ready', 'Bot finished warming up and processes updates',
+                       lambda: {(): int(self.ready)})
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str):
+        start = time.monotonic()
+        yield
+        self.stages[name] = time.monotonic() - start
+        logger.info(f'Startup stage {name}: {self.stages[name] * 1000:.0f} ms')
+
+    def imported(self):
+        """Время от старта процесса до запуска on_startup: импорты и создание объектов"""
+        self.stages['imports'] = time.monotonic() - started_at
+
+    def set_ready(self):
+        self.ready = True
+        self.ready_at = time.monotonic()
+        self.stages['ready'] = self.ready_at - started_at
+        logger.info(f'Bot is ready in {self.stages["ready"]:.2f} s')
+
+    def responded(self):
+        if self.first_response_at is not None:
+            return
+        self.first_response_at = time.monotonic()
+        self.stages['first_response'] = self.first_response_at - started_at
+        logger.info(f'First update processed {self.stages["first_response"]:.2f} s after start')
+
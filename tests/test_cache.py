@@ -0,0 +1,112 @@
+import asyncio
+
+from db.cache import DictionaryCache, LanguageCache, _LINK_SIZE, _size_of
+
+ENG = (0, 'eng')
+
+
+def rows(n: int, prefix: str = 'word') -> list[tuple[str, str, int, int]]:
+    return [(f'{prefix}{i}', f'definition {i}', i, i) for i in range(n)]
+
+
+def loader(data: dict[tuple[int, str], list[tuple[str, str, int, int]]], calls: list):
+    async def load(owner: int, lang: str) -> list[tuple[str, str, int, int]]:
+        calls.append((owner, lang))
+        await asyncio.sleep(0)
+        return data[(owner, lang)]
+
+    return load
+
+
+def test_language_size_accounting():
+    language = LanguageCache('eng')
+    language.add('book', 'a written work', 1, 1)
+    language.add('book', 'to reserve', 1, 2)
+    language.add('tome', 'a written work', 2, 1)
+    assert language.size == _size_of('book', 'tome', 'a written work', 'to reserve') + 3 * _LINK_SIZE
+    assert not language.add('book', 'to reserve', 1, 2)
+    language.remove('book')
+    assert language.size == _size_of('tome', 'a written work') + _LINK_SIZE
+    assert language.definitions == {1: 'a written work'}
+    assert len(language.sampler) == 1
+    language.remove('tome')
+    assert language.size == 0
+    assert language.prefix('bo') == []
+
+
+def test_get_loads_once():
+    async def run():
+        calls = []
+        cache = DictionaryCache(max_bytes=10 ** 6)
+        load = loader({ENG: rows(3)}, calls)
+        first, second = await asyncio.gather(cache.get(ENG, load), cache.get(ENG, load))
+        third = await cache.get(ENG, load)
+        return calls, cache, first, second, third
+
+    calls, cache, first, second, third = asyncio.run(run())
+    assert calls == [ENG]
+    assert first is second is third
+    assert cache.stats.as_dict() == {'hits': 1, 'misses': 2, 'loads': 1, 'evictions': 0}
+
+
+def test_lru_eviction_by_size():
+    async def run():
+        data = {(0, 'eng'): rows(10, 'eng'), (1, 'eng'): rows(10, 'own'), (0, 'fra'): rows(10, 'fra')}
+        one = LanguageCache('x')
+        for row in data[ENG]:
+            one.add(*row)
+        cache = DictionaryCache(max_bytes=one.size * 2)
+        load = loader(data, [])
+        await cache.get((0, 'eng'), load)
+        await cache.get((1, 'eng'), load)
+        await cache.get((0, 'eng'), load)
+        await cache.get((0, 'fra'), load)
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.peek((1, 'eng')) is None
+    assert cache.peek((0, 'eng')) is not None and cache.peek((0, 'fra')) is not None
+    assert len(cache) == 2
+    assert cache.size == sum(cache.peek(key).size for key in ((0, 'eng'), (0, 'fra')))
+    assert cache.size <= cache.max_bytes
+    assert cache.stats.evictions == 1
+
+
+def test_added_and_removed_update_cached_language():
+    async def run():
+        cache = DictionaryCache(max_bytes=10 ** 6)
+        language = await cache.get(ENG, loader({ENG: rows(1)}, []))
+        size = cache.size
+        cache.added(ENG, 'book', 'a written work', 100, 100)
+        assert language.rows('book') == [('book', 'a written work')]
+        assert cache.size == language.size > size
+        cache.removed(ENG, 'book')
+        assert language.rows('book') == []
+        return cache, size
+
+    cache, size = asyncio.run(run())
+    assert cache.size == size
+
+
+def test_change_during_load_is_not_cached():
+    async def run():
+        cache = DictionaryCache(max_bytes=10 ** 6)
+        loaded = asyncio.Event()
+        release = asyncio.Event()
+
+        async def load(owner: int, lang: str) -> list[tuple[str, str, int, int]]:
+            loaded.set()
+            await release.wait()
+            return rows(2)
+
+        task = asyncio.create_task(cache.get(ENG, load))
+        await loaded.wait()
+        cache.added(ENG, 'book', 'a written work', 100, 100)
+        release.set()
+        language = await task
+        return cache, language
+
+    cache, language = asyncio.run(run())
+    assert len(language.terms) == 2
+    assert cache.peek(ENG) is None
+    assert cache.size == 0
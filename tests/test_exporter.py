@@ -0,0 +1,79 @@
+import asyncio
+import io
+
+import exporter
+
+
+def format_term(word: str, definitions: list[str]) -> str:
+    return f'{word.upper()} - {", ".join(definitions)}'
+
+
+def install_terms(monkeypatch, rows: list[tuple[str, str]], batch_size: int = 3):
+    async def stream_all(lang: str, batch: int = 1000, owner: int = 0):
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+
+    monkeypatch.setattr(exporter.db, 'stream_all', stream_all)
+
+
+def pages(limit: int = exporter.TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    async def collect():
+        return [page async for page in exporter.iter_pages('eng', format_term, limit)]
+
+    return asyncio.run(collect())
+
+
+def test_definitions_are_grouped_across_batches(monkeypatch):
+    install_terms(monkeypatch, [('a', '1'), ('a', '2'), ('a', '3'), ('a', '4'), ('b', '5')])
+    assert pages() == ['A - 1, 2, 3, 4\nB - 5']
+
+
+def test_pages_fit_telegram_limit(monkeypatch):
+    rows = [(f'word{i:04}', 'определение ' * 5) for i in range(2000)]
+    install_terms(monkeypatch, rows, batch_size=1000)
+    result = pages()
+    assert len(result) > 1
+    assert all(len(page) <= exporter.TELEGRAM_MESSAGE_LIMIT for page in result)
+    lines = '\n'.join(result).split('\n')
+    assert lines == [format_term(word, [definition]) for word, definition in rows]
+
+
+def test_long_term_is_truncated(monkeypatch):
+    install_terms(monkeypatch, [('a', 'x' * 10000), ('b', 'y')])
+    result = pages()
+    assert [len(page) for page in result] == [exporter.TELEGRAM_MESSAGE_LIMIT, len('B - y')]
+
+
+def test_empty_dictionary(monkeypatch):
+    install_terms(monkeypatch, [])
+    assert pages() == []
+
+
+def test_write_file_formats(monkeypatch):
+    install_terms(monkeypatch, [('a', '1'), ('a', '2, 3'), ('b', '4')])
+    files = {}
+    for format_ in ('csv', 'jsonl'):
+        files[format_] = io.BytesIO()
+        assert asyncio.run(exporter.write_file('eng', files[format_], format_)) == 2
+    assert files['csv'].getvalue().decode() == 'a,1\r\na,"2, 3"\r\nb,4\r\n'
+    assert files['jsonl'].getvalue().decode().splitlines() == [
+        '{"word": "a", "definitions": ["1", "2, 3"]}', '{"word": "b", "definitions": ["4"]}']
+
+
+def test_stream_all_pages_by_last_row(monkeypatch):
+    table = sorted([(f'word{i % 7}', f'definition {i}', i) for i in range(20)], key=lambda el: (el[0], el[2]))
+    queries = []
+
+    async def select_all_after(owner, lang, word, definition_id, limit):
+        queries.append((word, definition_id))
+        return [row for row in table if (row[0], row[2]) > (word, definition_id)][:limit]
+
+    monkeypatch.setattr(exporter.db, '_select_all_after', select_all_after)
+
+    async def collect():
+        return [rows async for rows in exporter.db.stream_all('eng', 8)]
+
+    batches = asyncio.run(collect())
+    assert [len(el) for el in batches] == [8, 8, 4]
+    assert [row for rows in batches for row in rows] == [row[:2] for row in table]
+    assert queries == [('', 0), table[7][::2], table[15][::2]]
@@ -0,0 +1,91 @@
+import asyncio
+import io
+
+import pytest
+
+import importer
+
+
+@pytest.fixture
+def inserted(monkeypatch) -> list[list[tuple[str, str]]]:
+    chunks = []
+
+    async def insert_many(rows, lang, *args, **kwargs):
+        chunks.append(rows)
+        return rows
+
+    monkeypatch.setattr(importer.db, 'insert_many', insert_many)
+    return chunks
+
+
+async def translate(words: list[str]) -> list[str]:
+    return [f'{el}-ru' for el in words]
+
+
+def run_import(text: str, translate=translate, **kwargs) -> importer.ImportStats:
+    buffer = io.BytesIO(text.encode('utf-8-sig'))
+    return asyncio.run(importer.import_csv(buffer, 'eng', translate, **kwargs))
+
+
+def test_terms_and_translated_words_are_inserted(inserted):
+    stats = run_import('Book, книга\nbook, книга\ntable\nTable\nchair,\n')
+    rows = sorted(row for chunk in inserted for row in chunk)
+    assert rows == [('book', 'книга'), ('chair', 'chair-ru'), ('table', 'table-ru')]
+    assert (stats.rows, stats.duplicates, stats.translated, stats.inserted) == (5, 2, 2, 3)
+
+
+def test_invalid_rows_are_skipped(inserted):
+    long_word = 'a' * (importer.WORD_MAX_LENGTH + 1)
+    long_definition = 'b' * (importer.DEFINITION_MAX_LENGTH + 1)
+    stats = run_import(f', пусто\nbook, книга, лишнее\n{long_word}, слово\nbook, {long_definition}\n')
+    assert inserted == []
+    assert (stats.rows, stats.skipped, stats.inserted) == (4, 4, 0)
+
+
+def test_rows_are_inserted_in_chunks(inserted):
+    text = ''.join(f'word{i}, слово {i}\n' for i in range(5))
+    stats = run_import(text, chunk_size=2)
+    assert [len(el) for el in inserted] == [2, 2, 1]
+    assert stats.inserted == 5
+
+
+def test_failed_translation_is_counted(inserted):
+    async def translate(words):
+        raise RuntimeError('translator is down')
+
+    stats = run_import('book\ntable\n', translate)
+    assert inserted == []
+    assert (stats.translated, stats.untranslated) == (0, 2)
+
+
+def parse(text: str) -> importer.ParsedCsv:
+    return importer.parse_csv(text.encode('utf-8-sig'))
+
+
+def test_terms_and_words_without_translation():
+    parsed = parse('Book, бронировать\nbook, книга\ntable\nchair,\n')
+    assert parsed.terms == [('book', 'бронировать'), ('book', 'книга')]
+    assert parsed.words == ['table', 'chair']
+    assert (parsed.rows, parsed.duplicates, parsed.skipped) == (4, 0, 0)
+
+
+def test_duplicates_are_counted_once():
+    parsed = parse('book, книга\nBOOK,  книга \ntable\nTable\n')
+    assert parsed.terms == [('book', 'книга')]
+    assert parsed.words == ['table']
+    assert parsed.duplicates == 2
+
+
+def test_parse_skips_invalid_rows():
+    long_word = 'a' * (importer.WORD_MAX_LENGTH + 1)
+    long_definition = 'b' * (importer.DEFINITION_MAX_LENGTH + 1)
+    parsed = parse(f'\n, пусто\nbook, книга, лишнее\n{long_word}, слово\nbook, {long_definition}\n')
+    assert parsed.terms == []
+    assert parsed.words == []
+    assert parsed.skipped == 5
+    assert parsed.rows == 5
+
+
+def test_quoted_definition_with_comma():
+    parsed = parse('book,"книга, том"\n')
+    assert parsed.terms == [('book', 'книга, том')]
@@ -0,0 +1,91 @@
+import asyncio
+import random
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from bench.fake_bot import FAKE_TOKEN, message_update
+from ingress import UpdateQueue
+
+
+class RecordingMiddleware(BaseMiddleware):
+
+    def __init__(self, events: list[tuple[str, int]]):
+        super().__init__()
+        self.events: list[tuple[str, int]] = events
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        self.events.append(('pre', update.update_id))
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        self.events.append(('post', update.update_id))
+
+
+def recording_dispatcher() -> tuple[Dispatcher, list[tuple[int, str]], list[tuple[str, int]]]:
+    """Настоящий Dispatcher с обработчиком сообщений и middleware, которые записывают вызовы"""
+    dispatcher = Dispatcher(Bot(FAKE_TOKEN))
+    processed, events = [], []
+
+    @dispatcher.message_handler()
+    async def record(message: types.Message):
+        await asyncio.sleep(random.random() / 100)
+        processed.append((message.chat.id, message.text))
+
+    dispatcher.middleware.setup(RecordingMiddleware(events))
+    return dispatcher, processed, events
+
+
+def update(update_id: int, chat_id: int, text: str) -> types.Update:
+    return types.Update(**message_update(update_id, chat_id, text))
+
+
+def test_updates_of_one_chat_are_processed_in_order():
+    async def run():
+        dispatcher, processed, events = recording_dispatcher()
+        queue = UpdateQueue(dispatcher, concurrency=4)
+        for i in range(20):
+            for chat_id in (1, 2, 3):
+                assert queue.put(update(i * 3 + chat_id, chat_id, str(i)))
+        await queue.drain(5)
+        return queue, processed
+
+    queue, processed = asyncio.run(run())
+    assert queue.pending == 0
+    for chat_id in (1, 2, 3):
+        assert [text for el, text in processed if el == chat_id] == [str(i) for i in range(20)]
+
+
+def test_middleware_runs_for_queued_updates():
+    async def run():
+        dispatcher, processed, events = recording_dispatcher()
+        queue = UpdateQueue(dispatcher)
+        assert queue.put(update(1, 1, 'text'))
+        await queue.drain(5)
+        return processed, events
+
+    processed, events = asyncio.run(run())
+    assert processed == [(1, 'text')]
+    assert events == [('pre', 1), ('post', 1)]
+
+
+def test_put_rejects_when_full():
+    async def run():
+        queue = UpdateQueue(recording_dispatcher()[0], max_pending=2)
+        results = [queue.put(update(i, i, 'text')) for i in range(3)]
+        await queue.drain(5)
+        return results
+
+    assert asyncio.run(run()) == [True, True, False]
+
+
+def test_put_rejects_while_closing():
+    async def run():
+        queue = UpdateQueue(recording_dispatcher()[0])
+        assert queue.put(update(1, 1, 'text'))
+        drain = asyncio.create_task(queue.drain(5))
+        await asyncio.sleep(0)
+        rejected = not queue.put(update(2, 1, 'text'))
+        await drain
+        return rejected
+
+    assert asyncio.run(run())
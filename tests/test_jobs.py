@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import jobs
+
+
+def small_runner(**kwargs) -> jobs.JobRunner:
+    return jobs.JobRunner(process_workers=1, thread_workers=1, **kwargs)
+
+
+def test_job_result_and_on_finish():
+    async def run():
+        runner = small_runner()
+        await runner.start()
+        finished = asyncio.Event()
+
+        async def work(job: jobs.Job):
+            return await runner.cpu(sum, [1, 2, 3]) + await runner.io(len, 'abc')
+
+        async def on_finish(job: jobs.Job):
+            finished.set()
+
+        job = runner.submit(1, 'sum', work, on_finish)
+        await asyncio.wait_for(finished.wait(), 5)
+        await runner.close()
+        return job
+
+    job = asyncio.run(run())
+    assert (job.state, job.result, job.error) == (jobs.DONE, 9, None)
+
+
+def test_failed_job_keeps_error():
+    async def run():
+        runner = small_runner()
+        await runner.start()
+        finished = asyncio.Event()
+
+        async def work(job: jobs.Job):
+            raise ValueError('bad file')
+
+        async def on_finish(job: jobs.Job):
+            finished.set()
+
+        job = runner.submit(1, 'import', work, on_finish)
+        await asyncio.wait_for(finished.wait(), 5)
+        await runner.close()
+        return job
+
+    job = asyncio.run(run())
+    assert job.state == jobs.FAILED
+    assert isinstance(job.error, ValueError)
+
+
+def test_submit_limits():
+    async def work(job: jobs.Job):
+        pass
+
+    async def run():
+        runner = jobs.JobRunner(max_queue=2, per_user=1)
+        runner.submit(1, 'export', work)
+        with pytest.raises(jobs.JobRejected):
+            runner.submit(1, 'export', work)
+        runner.submit(2, 'export', work)
+        with pytest.raises(jobs.JobRejected):
+            runner.submit(3, 'export', work)
+        return runner
+
+    runner = asyncio.run(run())
+    assert [len(runner.jobs(user_id)) for user_id in (1, 2, 3)] == [1, 1, 0]
+
+
+def test_cancel_queued_and_running_jobs():
+    async def run():
+        runner = small_runner(workers=1, per_user=2)
+        await runner.start()
+        running = asyncio.Event()
+
+        async def work(job: jobs.Job):
+            running.set()
+            await asyncio.sleep(10)
+
+        first = runner.submit(1, 'import', work)
+        second = runner.submit(1, 'import', work)
+        await asyncio.wait_for(running.wait(), 5)
+        cancelled = runner.cancel(1)
+        await asyncio.wait([first.task])
+        assert runner.submit(1, 'import', work).state == jobs.QUEUED
+        await runner.close()
+        return first, second, cancelled
+
+    first, second, cancelled = asyncio.run(run())
+    assert cancelled == [first, second]
+    assert (first.state, second.state) == (jobs.CANCELLED, jobs.CANCELLED)
+    assert second.task is None
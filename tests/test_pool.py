@@ -0,0 +1,194 @@
+import asyncio
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db.pool
+from db.pool import Pool, PoolTimeout
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query: str, params: tuple = None):
+        if self.connection.broken:
+            self.connection.closed = 2
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.connection.status = psycopg2.extensions.STATUS_IN_TRANSACTION
+
+
+class FakeConnection:
+
+    def __init__(self, number: int):
+        self.number: int = number
+        self.closed: int = 0
+        self.broken: bool = False
+        self.status: int = psycopg2.extensions.STATUS_READY
+        self.rollbacks: int = 0
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+
+class FakeConnectionPool:
+
+    def __init__(self, minconn: int, maxconn: int, **dsn):
+        self.maxconn: int = maxconn
+        self.created: int = 0
+        self.idle: list[FakeConnection] = []
+        self.used: set[FakeConnection] = set()
+        self.dropped: list[FakeConnection] = []
+        self.lock = threading.Lock()
+        self.gate: threading.Event | None = None
+
+    def getconn(self) -> FakeConnection:
+        if self.gate is not None:
+            self.gate.wait()
+        with self.lock:
+            if self.idle:
+                connection = self.idle.pop()
+            else:
+                assert len(self.used) < self.maxconn, 'connection pool exhausted'
+                self.created += 1
+                connection = FakeConnection(self.created)
+            self.used.add(connection)
+            return connection
+
+    def putconn(self, connection: FakeConnection, close: bool = False):
+        with self.lock:
+            self.used.remove(connection)
+            (self.dropped if close else self.idle).append(connection)
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_pool(monkeypatch):
+    monkeypatch.setattr(db.pool, 'ThreadedConnectionPool', FakeConnectionPool)
+
+
+def query(connection: FakeConnection) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    return connection.number
+
+
+def test_run_returns_connection_rolled_back():
+    async def run():
+        pool = Pool(max_size=2)
+        await pool.open()
+        results = await asyncio.gather(*(pool.run(query) for _ in range(10)))
+        fake = pool._pool
+        await pool.close()
+        return pool, results, fake
+
+    pool, results, fake = asyncio.run(run())
+    assert set(results) <= {1, 2}
+    assert fake.used == set()
+    assert all(el.status == psycopg2.extensions.STATUS_READY for el in fake.idle)
+    assert pool.stats.acquired == 10
+
+
+def test_acquire_times_out_when_exhausted():
+    async def run():
+        pool = Pool(max_size=1, timeout=0.05)
+        await pool.open()
+        async with pool.acquire():
+            with pytest.raises(PoolTimeout):
+                await pool.run(query)
+        result = await pool.run(query)
+        await pool.close()
+        return pool, result
+
+    pool, result = asyncio.run(run())
+    assert result == 1
+    assert pool.stats.timeouts == 1
+
+
+def test_broken_connection_is_replaced():
+    async def run():
+        pool = Pool(max_size=2, health_check_interval=0)
+        await pool.open()
+        first = await pool.run(query)
+        pool._pool.idle[0].broken = True
+        second = await pool.run(query)
+        fake = pool._pool
+        await pool.close()
+        return pool, first, second, fake
+
+    pool, first, second, fake = asyncio.run(run())
+    assert (first, second) == (1, 2)
+    assert [el.number for el in fake.dropped] == [1]
+    assert pool.stats.broken == 1
+
+
+def blocking(started: threading.Event, release: threading.Event):
+    def query(connection: FakeConnection) -> int:
+        started.set()
+        release.wait()
+        return connection.number
+
+    return query
+
+
+def test_cancelled_run_keeps_connection_until_thread_finishes():
+    async def run():
+        pool = Pool(max_size=2)
+        await pool.open()
+        started, release = threading.Event(), threading.Event()
+        task = asyncio.create_task(pool.run(blocking(started, release)))
+        await asyncio.to_thread(started.wait)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        in_use = [el.number for el in pool._pool.used]
+        other = await pool.run(query)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        fake = pool._pool
+        await pool.close()
+        return in_use, other, fake
+
+    in_use, other, fake = asyncio.run(run())
+    assert in_use == [1]
+    assert other == 2
+    assert fake.used == set()
+
+
+def test_cancelled_acquire_returns_connection():
+    async def run():
+        pool = Pool(max_size=1)
+        await pool.open()
+        pool._pool.gate = threading.Event()
+        task = asyncio.create_task(pool.run(query))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        pool._pool.gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        fake = pool._pool
+        result = await pool.run(query)
+        await pool.close()
+        return result, fake
+
+    result, fake = asyncio.run(run())
+    assert result == 1
+    assert fake.used == set()
+    assert [el.number for el in fake.idle] == [1]
@@ -0,0 +1,104 @@
+import asyncio
+from collections import OrderedDict
+
+import psycopg2
+import pytest
+
+import db.db as db
+from db.pool import PoolTimeout
+from db.replicas import Replicas
+
+
+class FakePool:
+
+    def __init__(self, name: str, lag: float = 0.0, error: Exception = None):
+        self.name: str = name
+        self.lag: float = lag
+        self.error: Exception | None = error
+        self.timeout: float = 1.0
+        self.opened: bool = True
+        self.calls: int = 0
+
+    async def run(self, fn, *args):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if fn is db._execute:
+            return [(self.name,)]
+        return self.lag
+
+    async def close(self):
+        pass
+
+
+def fake_replicas(*pools: FakePool, max_lag: float = 5.0) -> Replicas:
+    replicas = Replicas([], max_lag=max_lag)
+    replicas.pools = list(pools)
+    replicas.healthy = [True] * len(pools)
+    replicas.lag = [0.0] * len(pools)
+    return replicas
+
+
+def test_pool_round_robin_skips_unhealthy():
+    first, second, third = FakePool('first'), FakePool('second'), FakePool('third')
+    replicas = fake_replicas(first, second, third)
+    replicas.failed(second, psycopg2.OperationalError('gone'))
+    assert [replicas.pool() for _ in range(4)] == [first, third, first, third]
+    replicas.failed(first, psycopg2.OperationalError('gone'))
+    replicas.failed(third, psycopg2.OperationalError('gone'))
+    assert replicas.pool() is None
+
+
+def test_check_marks_lagging_and_unavailable_replicas():
+    replicas = fake_replicas(FakePool('fresh', lag=1.0), FakePool('lagging', lag=10.0),
+                             FakePool('down', error=psycopg2.OperationalError('gone')),
+                             FakePool('timeout', error=PoolTimeout()))
+    asyncio.run(replicas.check())
+    assert replicas.healthy == [True, False, False, False]
+    assert replicas.lag == [1.0, 10.0, None, None]
+    replicas.pools[1].lag = 2.0
+    asyncio.run(replicas.check())
+    assert replicas.healthy == [True, True, False, False]
+
+
+@pytest.fixture
+def servers(monkeypatch) -> tuple[FakePool, FakePool, Replicas]:
+    primary, replica = FakePool('primary'), FakePool('replica')
+    replicas = fake_replicas(replica)
+    monkeypatch.setattr(db, 'pool', primary)
+    monkeypatch.setattr(db, 'replicas', replicas)
+    monkeypatch.setattr(db, '_written', OrderedDict())
+    return primary, replica, replicas
+
+
+def run_query(read: bool) -> list:
+    return asyncio.run(db._run('test', db._execute, ['SELECT 1'], read=read))
+
+
+def test_reads_go_to_replica_and_writes_to_primary(servers):
+    assert run_query(read=True) == [('replica',)]
+    assert run_query(read=False) == [('primary',)]
+
+
+def test_failed_replica_read_falls_back_to_primary(servers):
+    primary, replica, replicas = servers
+    replica.error = psycopg2.OperationalError('connection reset')
+    assert run_query(read=True) == [('primary',)]
+    assert replicas.healthy == [False]
+    assert run_query(read=True) == [('primary',)]
+    assert replica.calls == 1
+
+
+def test_primary_block_forces_primary(servers):
+    async def run():
+        with db.primary():
+            return await db._run('test', db._execute, ['SELECT 1'], read=True)
+
+    assert asyncio.run(run()) == [('primary',)]
+
+
+def test_recent_write_reads_from_primary(servers):
+    assert not db._recently_wrote(7)
+    db._wrote(7)
+    assert db._recently_wrote(7)
+    assert not db._recently_wrote(8)
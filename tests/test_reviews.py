@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import reviews
+
+
+def test_intervals_grow_with_ease():
+    review = reviews.Review()
+    assert [review.answer(reviews.CORRECT_QUALITY) for _ in range(4)] == [1, 6, 15, 38]
+    assert review.repetitions == 4
+    assert review.ease == pytest.approx(2.5)
+
+
+def test_wrong_answer_resets_repetitions():
+    review = reviews.Review(repetitions=3, interval=15, ease=2.5)
+    assert review.answer(reviews.WRONG_QUALITY) == 1
+    assert review.repetitions == 0
+    assert review.ease == pytest.approx(2.5 - 0.54)
+    assert review.answer(reviews.CORRECT_QUALITY) == 1
+    assert review.answer(reviews.CORRECT_QUALITY) == 6
+
+
+def test_ease_does_not_drop_below_floor():
+    review = reviews.Review()
+    for _ in range(10):
+        review.answer(0)
+    assert review.ease == 1.3
+
+
+def test_due_queue_pops_most_overdue_first():
+    queue = reviews.DueQueue()
+    for word_id, due_at in [(1, 30.0), (2, 10.0), (3, 20.0)]:
+        queue.push(word_id, due_at)
+    assert [queue.pop() for _ in range(4)] == [2, 3, 1, None]
+
+
+def test_due_queue_skips_discarded_and_rescheduled_entries():
+    queue = reviews.DueQueue()
+    queue.push(1, 10.0)
+    queue.push(2, 20.0)
+    queue.push(3, 30.0)
+    queue.discard(1)
+    queue.push(2, 40.0)
+    assert len(queue) == 2
+    assert [queue.pop() for _ in range(3)] == [3, 2, None]
+    assert len(queue) == 0
+
+
+class FakeReviewTable:
+
+    def __init__(self):
+        self.rows: dict[tuple[int, int], tuple] = {}
+        self.fail: int = 0
+
+    async def select_word_ids(self, words: list[str], lang: str, owner: int = 0) -> list[int]:
+        return [int(el) for el in words]
+
+    async def select_reviews(self, keys: list[tuple[int, int]]) -> list[tuple]:
+        return [key + self.rows[key][2:5] for key in keys if key in self.rows]
+
+    async def upsert_reviews(self, rows: list[tuple]):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('connection lost')
+        for row in rows:
+            self.rows[row[:2]] = row
+
+
+@pytest.fixture
+def table(monkeypatch) -> FakeReviewTable:
+    table = FakeReviewTable()
+    for name in ('select_word_ids', 'select_reviews', 'upsert_reviews'):
+        monkeypatch.setattr(reviews.db, name, getattr(table, name))
+    return table
+
+
+def test_flush_applies_answers_in_order(table):
+    async def run():
+        scheduler = reviews.ReviewScheduler()
+        await scheduler.record(1, 'eng', ('10',), True)
+        await scheduler.record(1, 'eng', ('10', '11'), True)
+        await scheduler.flush()
+
+    asyncio.run(run())
+    assert table.rows[(1, 10)][2:4] == (2, 6)
+    assert table.rows[(1, 11)][2:4] == (1, 1)
+
+
+def test_failed_flush_keeps_answers(table):
+    async def run():
+        scheduler = reviews.ReviewScheduler()
+        await scheduler.record(1, 'eng', ('10',), True)
+        table.fail = 1
+        with pytest.raises(RuntimeError):
+            await scheduler.flush()
+        await scheduler.record(1, 'eng', ('10',), True)
+        assert len(scheduler._pending) == 2
+        await scheduler.flush()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler._pending == []
+    assert table.rows[(1, 10)][2:4] == (2, 6)
@@ -0,0 +1,52 @@
+from db.sampler import LinkSampler
+
+
+def filled(pairs: list[tuple[int, int]]) -> LinkSampler:
+    sampler = LinkSampler()
+    for word_id, definition_id in pairs:
+        sampler.add(word_id, definition_id)
+    return sampler
+
+
+def test_sample_distinct_has_no_repeated_words_or_definitions():
+    # у каждого слова по 3 определения, определения общие у соседних слов
+    sampler = filled([(word_id, word_id + i) for word_id in range(100) for i in range(3)])
+    for n in (1, 4, 20, 50):
+        for _ in range(50):
+            sample = sampler.sample(n, distinct=True)
+            assert len(sample) == n
+            assert len({el[0] for el in sample}) == n
+            assert len({el[1] for el in sample}) == n
+
+
+def test_sample_distinct_returns_fewer_when_impossible():
+    sampler = filled([(1, 1), (1, 2), (2, 1)])
+    sample = sampler.sample(3, distinct=True)
+    assert len(sample) <= 2
+    assert len({el[0] for el in sample}) == len(sample) == len({el[1] for el in sample})
+
+
+def test_sample_is_subset_without_repeats():
+    pairs = [(i, i) for i in range(10)]
+    sampler = filled(pairs)
+    assert sorted(sampler.sample(100)) == pairs
+    assert sampler.sample(0) == []
+
+
+def test_add_ignores_duplicates():
+    sampler = filled([(1, 1), (1, 1)])
+    assert len(sampler) == 1
+
+
+def test_remove_swaps_last_pair_into_place():
+    sampler = filled([(1, 10), (2, 20), (3, 30), (4, 40)])
+    assert sampler.remove(2, 20)
+    assert not sampler.remove(2, 20)
+    assert len(sampler) == 3
+    assert list(zip(sampler.word_ids, sampler.definition_ids)) == [(1, 10), (4, 40), (3, 30)]
+    assert sampler._positions == {(1, 10): 0, (4, 40): 1, (3, 30): 2}
+    assert sampler.remove(3, 30)
+    assert sampler.remove(1, 10)
+    assert list(zip(sampler.word_ids, sampler.definition_ids)) == [(4, 40)]
+    assert sampler._positions == {(4, 40): 0}
+    assert sorted(sampler.sample(5)) == [(4, 40)]
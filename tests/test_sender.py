@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+import sender
+from bench.fake_bot import FAKE_TOKEN, FakeTelegram
+
+
+def flaky(failures: int, calls: list):
+    """Запрос, который первые failures раз получает flood control"""
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise RetryAfter(0)
+        return 'ok'
+
+    return call
+
+
+def test_retry_after_requeues():
+    async def run():
+        calls = []
+        result = await sender.Sender(max_retries=5).submit(1, flaky(2, calls))
+        return result, calls
+
+    result, calls = asyncio.run(run())
+    assert result == 'ok'
+    assert len(calls) == 3
+
+
+def test_max_retries():
+    calls = []
+
+    async def run():
+        await sender.Sender(max_retries=2).submit(1, flaky(100, calls))
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(run())
+    assert len(calls) == 3
+
+
+def test_interactive_before_bulk():
+    order = []
+
+    def call(name: str):
+        async def send():
+            order.append(name)
+        return send
+
+    async def run():
+        queue = sender.Sender(rate=1000, chat_rate=1000, chat_burst=1000, max_in_flight=1)
+        await asyncio.gather(*[queue.submit(i, call(f'bulk {i}'), sender.BULK) for i in range(5)],
+                             *[queue.submit(i, call(f'reply {i}'), sender.INTERACTIVE) for i in range(5)])
+
+    asyncio.run(run())
+    assert order == [f'reply {i}' for i in range(5)] + [f'bulk {i}' for i in range(5)]
+
+
+def test_bulk_context_sets_priority():
+    async def run():
+        queue = sender.Sender()
+        with sender.bulk():
+            task = asyncio.create_task(queue.submit(1, flaky(0, [])))
+        await asyncio.sleep(0)
+        priorities = [item.priority for items in queue._queues for item in items]
+        await task
+        return priorities
+
+    assert asyncio.run(run()) == [sender.BULK]
+
+
+def test_chat_pacing():
+    sent = {1: [], 2: []}
+
+    def call(chat_id: int):
+        async def send():
+            sent[chat_id].append(time.monotonic())
+        return send
+
+    async def run():
+        queue = sender.Sender(rate=1000, chat_rate=10, chat_burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*[queue.submit(chat_id, call(chat_id)) for _ in range(3) for chat_id in (1, 2)])
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    for times in sent.values():
+        assert len(times) == 3
+        assert all(b - a >= 0.08 for a, b in zip(times, times[1:]))
+    # чаты не ждут друг друга: 3 сообщения при 10/с на чат, а не 6
+    assert elapsed < 0.45
+
+
+def test_scheduled_bot_avoids_flood_control():
+    telegram = FakeTelegram(chat_interval=0.05)
+
+    async def run():
+        bot = sender.ScheduledBot(token=FAKE_TOKEN, sender=sender.Sender(rate=1000, chat_rate=15, chat_burst=1))
+        telegram.install(bot)
+        try:
+            await asyncio.gather(*[bot.send_message(1, f'message {i}') for i in range(5)])
+        finally:
+            await bot.sender.close()
+
+    asyncio.run(run())
+    assert telegram.calls['sendMessage'] == 5
+    assert telegram.flood_errors == 0
+
+
+def test_call_with_files_is_not_retried():
+    calls = []
+
+    async def run():
+        await sender.Sender().submit(1, flaky(1, calls), retry=False)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_scheduled_bot_disables_retry_for_files():
+    submitted = []
+
+    class RecordingSender:
+
+        async def submit(self, chat_id, call, priority=None, retry=True):
+            submitted.append(retry)
+
+    async def run():
+        bot = sender.ScheduledBot(token=FAKE_TOKEN, sender=RecordingSender())
+        await bot.request('sendMessage', {'chat_id': 1, 'text': 'hi'})
+        await bot.request('sendDocument', {'chat_id': 1}, {'document': object()})
+
+    asyncio.run(run())
+    assert submitted == [True, False]
+
+
+def test_cancelled_submit_is_skipped():
+    calls = []
+
+    async def run():
+        queue = sender.Sender(rate=1000, chat_rate=1, chat_burst=1)
+        await queue.submit(1, flaky(0, []))
+        task = asyncio.create_task(queue.submit(1, flaky(0, calls)))
+        await asyncio.sleep(0)
+        task.cancel()
+        result = await queue.submit(1, flaky(0, []))
+        return queue, result
+
+    queue, result = asyncio.run(run())
+    assert result == 'ok'
+    assert calls == []
+    assert queue.depth == 0
+
+
+def test_result_after_cancel_is_dropped():
+    async def run():
+        queue = sender.Sender()
+        items = [sender._Item(1, sender.INTERACTIVE, call, True, asyncio.get_running_loop().create_future())
+                 for call in (flaky(0, []), flaky(100, []))]
+        for item in items:
+            item.future.cancel()
+            await queue._in_flight.acquire()
+            await queue._send(item)
+        return queue, items
+
+    queue, items = asyncio.run(run())
+    assert all(item.future.cancelled() for item in items)
+    assert queue.depth == 0
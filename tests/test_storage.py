@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import pytest
+
+import db.db as db
+from db.storage import PostgresStorage
+
+
+class FakeFsmTable:
+
+    def __init__(self, rows: dict = None):
+        self.rows: dict[tuple[int, int], tuple] = rows or {}
+        self.selects: list[tuple[int, int]] = []
+        self.upserts: list[list[tuple]] = []
+        self.deletes: list[list[tuple[int, int]]] = []
+        self.fail: int = 0
+
+    async def select_fsm(self, chat_id: int, user_id: int):
+        self.selects.append((chat_id, user_id))
+        await asyncio.sleep(0)
+        return self.rows.get((chat_id, user_id))
+
+    async def upsert_fsm(self, rows: list[tuple], empty: list[tuple[int, int]]):
+        rows = [(chat_id, user_id, state, json.loads(data), json.loads(bucket))
+                for chat_id, user_id, state, data, bucket in rows]
+        await asyncio.sleep(0)
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('connection lost')
+        self.upserts.append(rows)
+        self.deletes.append(empty)
+        for chat_id, user_id, state, data, bucket in rows:
+            self.rows[(chat_id, user_id)] = (state, data, bucket)
+        for key in empty:
+            self.rows.pop(key, None)
+
+
+@pytest.fixture
+def table(monkeypatch) -> FakeFsmTable:
+    table = FakeFsmTable({(1, 1): ('Quiz:answer', {'n': 1}, {})})
+    monkeypatch.setattr(db, 'select_fsm', table.select_fsm)
+    monkeypatch.setattr(db, 'upsert_fsm', table.upsert_fsm)
+    return table
+
+
+def test_changes_within_an_update_are_coalesced(table):
+    async def run():
+        storage = PostgresStorage()
+        states = await asyncio.gather(*(storage.get_state(chat=1, user=1) for _ in range(3)))
+        await storage.set_state(chat=1, user=1, state='Quiz:next')
+        await storage.update_data(chat=1, user=1, n=2)
+        await storage.update_data(chat=1, user=1, data={'m': 3})
+        await storage.set_state(chat=2, user=2, state='Add:word')
+        await storage.flush()
+        return storage, states
+
+    storage, states = asyncio.run(run())
+    assert states == ['Quiz:answer'] * 3
+    assert table.selects == [(1, 1), (2, 2)]
+    assert len(table.upserts) == 1
+    assert sorted(table.upserts[0]) == [(1, 1, 'Quiz:next', {'n': 2, 'm': 3}, {}), (2, 2, 'Add:word', {}, {})]
+    assert storage._records == {}
+
+
+def test_clean_records_are_evicted_without_a_write(table):
+    async def run():
+        storage = PostgresStorage()
+        assert await storage.get_data(chat=1, user=1) == {'n': 1}
+        assert len(storage._records) == 1
+        await storage.flush()
+        await storage.get_state(chat=1, user=1)
+        return storage
+
+    storage = asyncio.run(run())
+    assert table.upserts == []
+    assert table.selects == [(1, 1), (1, 1)]
+
+
+def test_finished_state_is_deleted(table):
+    async def run():
+        storage = PostgresStorage()
+        await storage.finish(chat=1, user=1)
+        await storage.flush()
+
+    asyncio.run(run())
+    assert (table.upserts, table.deletes) == ([[]], [[(1, 1)]])
+    assert (1, 1) not in table.rows
+
+
+def test_failed_write_is_retried(table):
+    async def run():
+        storage = PostgresStorage()
+        await storage.set_state(chat=1, user=1, state='Quiz:next')
+        table.fail = 1
+        with pytest.raises(RuntimeError):
+            await storage.flush()
+        assert table.upserts == []
+        await storage.update_data(chat=2, user=2, n=5)
+        await storage.flush()
+        return storage
+
+    storage = asyncio.run(run())
+    assert sorted(table.upserts[0]) == [(1, 1, 'Quiz:next', {'n': 1}, {}), (2, 2, None, {'n': 5}, {})]
+    assert table.rows[(1, 1)] == ('Quiz:next', {'n': 1}, {})
+    assert storage._records == {}
+
+
+def test_change_during_write_is_kept(table):
+    async def run():
+        storage = PostgresStorage()
+        await storage.set_state(chat=1, user=1, state='Quiz:next')
+        flush = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0)
+        await storage.set_state(chat=1, user=1, state='Quiz:answer')
+        await flush
+        assert (1, 1) in storage._records
+        await storage.flush()
+
+    asyncio.run(run())
+    assert [rows[0][2] for rows in table.upserts] == ['Quiz:next', 'Quiz:answer']
+
+
+def test_data_changed_during_write_is_not_mixed_in(table):
+    async def run():
+        storage = PostgresStorage()
+        await storage.update_data(chat=1, user=1, n=2, m=2)
+        flush = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0)
+        await storage.update_data(chat=1, user=1, n=3)
+        await flush
+        written = table.rows[(1, 1)]
+        await storage.flush()
+        return written
+
+    written = asyncio.run(run())
+    assert written == ('Quiz:answer', {'n': 2, 'm': 2}, {})
+    assert table.rows[(1, 1)] == ('Quiz:answer', {'n': 3, 'm': 2}, {})
+
+
+class RecordingCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query: str, params: tuple = None):
+        self.connection.queries.append((query, params))
+
+
+class RecordingConnection:
+
+    def __init__(self):
+        self.queries: list[tuple[str, tuple | None]] = []
+        self.prepared: set[str] = set()
+        self.commits: int = 0
+
+    def cursor(self) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_empty_states_are_deleted_in_the_same_transaction():
+    connection = RecordingConnection()
+    db._upsert_fsm(connection, [(1, 1, 'Quiz:next', '{"n": 1}', '{}')], [(2, 2)])
+    db._upsert_fsm(connection, [], [(3, 3)])
+    executed = [(query, params) for query, params in connection.queries if query.startswith('EXECUTE')]
+    assert executed == [
+        (db.upsert_fsm_statement.execute_sql, ([1], [1], ['Quiz:next'], ['{"n": 1}'], ['{}'])),
+        (db.delete_fsm_statement.execute_sql, ([2], [2])),
+        (db.delete_fsm_statement.execute_sql, ([3], [3]))]
+    assert len(connection.queries) == 5
+    assert connection.commits == 2
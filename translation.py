@@ -0,0 +1,90 @@
+import asyncio
+import csv
+import os
+import time
+from typing import Callable
+
+from loguru import logger
+
+import db.db as db
+
+GOOGLE_LANG_CODES = {
+    'eng': 'en'
+}
+
+
+class GoogleTranslator:
+
+    def __init__(self):
+        from googletrans import Translator
+        self._translator = Translator()
+
+    def translate(self, words: list[str], source: str, dest: str) -> list[str]:
+        return [el.text for el in self._translator.translate(words, dest=GOOGLE_LANG_CODES.get(dest, dest),
+                                                             src=GOOGLE_LANG_CODES.get(source, source))]
+
+
+class DictionaryTranslator:
+    """Офлайн-перевод по словарю. Неизвестные слова переводятся в пустую строку"""
+
+    def __init__(self, translations: dict[str, str] = None):
+        self.translations: dict[str, str] = translations or {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'DictionaryTranslator':
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls({row[0].strip().lower(): row[1].strip() for row in csv.reader(file) if len(row) >= 2})
+
+    def translate(self, words: list[str], source: str, dest: str) -> list[str]:
+        return [self.translations.get(word, '') for word in words]
+
+
+class CachedTranslator:
+    """Перевод с постоянным кэшем в БД: переводчик вызывается только для слов, которых нет в кэше.
+
+    Сам переводчик создаётся фабрикой при первом промахе кэша, чтобы не импортировать
+    googletrans и не читать словарь при запуске бота. Лишние строки кэша удаляются
+    не чаще раза в evict_interval секунд, а не после каждой пачки.
+    """
+
+    def __init__(self, create_backend: Callable[[], object], max_rows: int = 100000, evict_interval: float = 60):
+        self.create_backend: Callable[[], object] = create_backend
+        self.max_rows: int = max_rows
+        self.evict_interval: float = evict_interval
+        self._evicted_at: float = time.monotonic()
+        self._backend = None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.create_backend()
+            logger.info(f'Using {type(self._backend).__name__} for translations')
+        return self._backend
+
+    async def translate(self, words: list[str], source: str, dest: str) -> list[str]:
+        cached = await db.select_translations(words, source, dest)
+        misses = list(dict.fromkeys(word for word in words if word not in cached))
+        self.hits += len(words) - len(misses)
+        self.misses += len(misses)
+        if misses:
+            translations = await asyncio.to_thread(lambda: self.backend.translate(misses, source, dest))
+            new = {word: translation for word, translation in zip(misses, translations) if translation}
+            await db.insert_translations(new, source, dest)
+            cached.update(new)
+            if time.monotonic() - self._evicted_at > self.evict_interval:
+                self._evicted_at = time.monotonic()
+                await db.evict_translations(self.max_rows)
+        return [cached.get(word, '') for word in words]
+
+
+def create_backend():
+    if os.getenv('TRANSLATOR', 'google') == 'dictionary':
+        return DictionaryTranslator.from_file(os.getenv('TRANSLATOR_DICTIONARY_FILE', 'dictionary.csv'))
+    return GoogleTranslator()
+
+
+def create_translator() -> CachedTranslator:
+    return CachedTranslator(create_backend, max_rows=int(os.getenv('TRANSLATION_CACHE_MAX_ROWS', 100000)),
+                            evict_interval=float(os.getenv('TRANSLATION_CACHE_EVICT_INTERVAL', 60)))